@@ -0,0 +1,172 @@
+import argparse
+import os
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+
+from utils.history_store import HISTORY_DIR, add_save_listener, get_history_store
+
+# Usage aggregates kept up to date by the history save listener, so dashboards read a few
+# rows per day/value instead of rescanning every saved prompt. Template names and generation
+# latency are not part of saved history, so a rebuild can only backfill the other aggregates.
+ANALYTICS_DB = HISTORY_DIR / "analytics.db"
+ALL_USERS = "*"
+MIX_DIMENSIONS = ("tone", "output_type", "template")
+
+_analytics = None
+_analytics_lock = threading.Lock()
+
+
+class Analytics:
+    def __init__(self, db_path=ANALYTICS_DB):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS daily (
+                    user TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    prompts INTEGER NOT NULL DEFAULT 0,
+                    prompt_chars INTEGER NOT NULL DEFAULT 0,
+                    generations INTEGER NOT NULL DEFAULT 0,
+                    generation_ms REAL NOT NULL DEFAULT 0,
+                    first_token_ms REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user, day)
+                );
+                CREATE TABLE IF NOT EXISTS mix (
+                    user TEXT NOT NULL,
+                    dimension TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    prompts INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user, dimension, value)
+                );
+            """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _apply(self, conn, user, daily, mix):
+        # daily: {day: [prompts, chars, generations, generation_ms, first_token_ms]}; mix: Counter of (dimension, value).
+        conn.executemany("""
+            INSERT INTO daily (user, day, prompts, prompt_chars, generations, generation_ms, first_token_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user, day) DO UPDATE SET
+                prompts = prompts + excluded.prompts,
+                prompt_chars = prompt_chars + excluded.prompt_chars,
+                generations = generations + excluded.generations,
+                generation_ms = generation_ms + excluded.generation_ms,
+                first_token_ms = first_token_ms + excluded.first_token_ms
+        """, ((user, day, *values) for day, values in daily.items()))
+        conn.executemany("""
+            INSERT INTO mix (user, dimension, value, prompts) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user, dimension, value) DO UPDATE SET prompts = prompts + excluded.prompts
+        """, ((user, dimension, value, count) for (dimension, value), count in mix.items()))
+
+    def record(self, user, rows):
+        # Folds saved rows into the aggregates in one transaction.
+        daily = {}
+        mix = Counter()
+        for row in rows:
+            day = str(row.get("timestamp") or "")[:10]
+            totals = daily.setdefault(day, [0, 0, 0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += len(str(row.get("prompt") or ""))
+            if row.get("total_ms") is not None:
+                totals[2] += 1
+                totals[3] += float(row["total_ms"])
+                totals[4] += float(row.get("first_token_ms") or 0.0)
+            for dimension in MIX_DIMENSIONS:
+                if row.get(dimension):
+                    mix[dimension, str(row[dimension])] += 1
+        with self._conn() as conn:
+            self._apply(conn, user, daily, mix)
+
+    def rebuild(self, store, users=None, batch=5000):
+        # Recomputes prompt counts, lengths and the tone/format mix from saved history.
+        # Latency and template counts only exist from live saves, so they are kept.
+        users = list(users or store.users())
+        if not users:
+            return {}
+        with self._conn() as conn:
+            placeholders = ", ".join("?" * len(users))
+            conn.execute(f"UPDATE daily SET prompts = 0, prompt_chars = 0 WHERE user IN ({placeholders})", users)
+            conn.execute(f"DELETE FROM mix WHERE dimension != 'template' AND user IN ({placeholders})", users)
+        counts = {}
+        for user in users:
+            rows = store.load(user).fillna("").to_dict("records")
+            for start in range(0, len(rows), batch):
+                self.record(user, [{k: v for k, v in row.items() if k != "template"} for row in rows[start:start + batch]])
+            counts[user] = len(rows)
+        return counts
+
+    def users(self):
+        return [row[0] for row in self._conn().execute("SELECT DISTINCT user FROM daily ORDER BY user")]
+
+    def daily(self, user=ALL_USERS, since=None):
+        import pandas as pd
+        where, params = self._where(user, since)
+        return pd.read_sql_query(f"""
+            SELECT day, SUM(prompts) AS prompts, SUM(generations) AS generations, SUM(generation_ms) AS generation_ms,
+                   SUM(prompt_chars) * 1.0 / NULLIF(SUM(prompts), 0) AS avg_prompt_chars,
+                   SUM(generation_ms) / NULLIF(SUM(generations), 0) AS avg_generation_ms,
+                   SUM(first_token_ms) / NULLIF(SUM(generations), 0) AS avg_first_token_ms
+            FROM daily WHERE {where} GROUP BY day ORDER BY day
+        """, self._conn(), params=params)
+
+    def mix(self, dimension, user=ALL_USERS, limit=20):
+        import pandas as pd
+        where, params = self._where(user)
+        return pd.read_sql_query(f"""
+            SELECT value, SUM(prompts) AS prompts FROM mix
+            WHERE dimension = ? AND {where} GROUP BY value ORDER BY prompts DESC LIMIT ?
+        """, self._conn(), params=[dimension, *params, limit])
+
+    def per_user(self):
+        import pandas as pd
+        return pd.read_sql_query("""
+            SELECT user, SUM(prompts) AS prompts,
+                   SUM(prompt_chars) * 1.0 / NULLIF(SUM(prompts), 0) AS avg_prompt_chars,
+                   SUM(generation_ms) / NULLIF(SUM(generations), 0) AS avg_generation_ms
+            FROM daily GROUP BY user ORDER BY prompts DESC
+        """, self._conn())
+
+    def _where(self, user, since=None):
+        clauses, params = ["1 = 1"], []
+        if user != ALL_USERS:
+            clauses.append("user = ?")
+            params.append(user)
+        if since:
+            clauses.append("day >= ?")
+            params.append(f"{since:%Y-%m-%d}")
+        return " AND ".join(clauses), params
+
+
+def get_analytics():
+    global _analytics
+    with _analytics_lock:
+        if _analytics is None:
+            _analytics = Analytics(os.getenv("ANALYTICS_DB", ANALYTICS_DB))
+        return _analytics
+
+
+def _on_saved(user, row):
+    get_analytics().record(user, [row])
+
+
+add_save_listener(_on_saved)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild usage aggregates from saved prompt history.")
+    parser.add_argument("users", nargs="*", help="users to rebuild (default: every user with history)")
+    args = parser.parse_args()
+    for user, rows in get_analytics().rebuild(get_history_store(), args.users).items():
+        print(f"{user}: {rows} rows")
@@ -1,90 +1,143 @@
-import streamlit as st
-import google.generativeai as genai
-from datetime import datetime
-import os
-import random
-from pathlib import Path
 from dotenv import load_dotenv
 
+# First of all: perf, auth and the deferred imports below read their settings at import time.
+load_dotenv()
+
+from utils import perf, profiling
+
+profiling.start_run()
+perf.begin_request()
+
+import streamlit as st
+
 from utils import auth
-from utils.helpers import (
-    load_lottiefile, load_prompt_history,
-    save_prompt_history, build_prompt
-)
-from utils.constants import valid_tones, output_types, tips
-from utils.prompts import get_flat_templates
-from utils.ui import render_header, render_sidebar, render_footer
 
 # --- Setup ---
-load_dotenv()
 st.set_page_config(page_title="Prompt Synthesizer", page_icon="🧠", layout="wide")
 
-auth.init_session_state()
+with profiling.phase("auth"), perf.span("auth"):
+    auth.init_session_state()
 
-# --- Auth ---
-if st.session_state['user'] is None:
-    auth.login()
-    st.stop()
+    # --- Auth ---
+    if st.session_state['user'] is None:
+        auth.login()
+        profiling.report("login screen")
+        perf.end_request()
+        st.stop()
+
+# Everything below only runs after login, so the login form never pays for these imports.
+with profiling.phase("imports"):
+    from datetime import datetime
+    import os
+    import random
+    from pathlib import Path
+
+    from utils.resources import get_model, get_lottie
+    from utils.history_store import get_history_store
+    from utils.response_cache import get_response_cache, flights
+    from utils.inception import run_inception
+    from utils.similarity import fetch_row, get_goal_index
+    from utils.transcription import discard as discard_audio, spool_upload, transcribe_async, retry as retry_transcription
+    from utils.generation import (
+        matrix_variants, remix_variants, run_concurrently, MATRIX_MAX_CONCURRENCY, REMIX_MAX_CONCURRENCY,
+    )
+    from utils.jobs import get_job_queue
+    from utils import analytics  # noqa: F401 -- registers the save listener that keeps usage aggregates current
+    from utils.constants import valid_tones, output_types, tips
+    from utils.prompts import get_flat_templates
+    from utils.ui import render_header, render_sidebar, render_footer, render_history, render_export, render_perf_panel
 
 # --- Sidebar: Logout + UI ---
 st.sidebar.write(f"Logged in as: `{st.session_state['user']}`")
 if st.sidebar.button("🚪 Logout"):
     auth.logout()
+if auth.is_admin(st.session_state['user']):
+    with st.sidebar:
+        render_perf_panel()
 
 # --- Load Gemini API Key ---
-GOOGLE_API_KEY = st.secrets.get("GOOGLE_API_KEY") or os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_API_KEY:
-    st.error("❌ GOOGLE_API_KEY not found.")
-    st.stop()
-
-try:
-    genai.configure(api_key=GOOGLE_API_KEY)
-    model = genai.GenerativeModel("models/gemini-1.5-flash")
-except Exception as e:
-    st.error(f"Gemini model error: {e}")
-    st.stop()
-
-# --- Load Lottie ---
-lottie_path = Path(__file__).parent / "idea.json"
-if not lottie_path.exists():
-    lottie_path = Path("idea.json")
-lottie_json = load_lottiefile(str(lottie_path))
-
-# --- Tip Setup ---
-if st.session_state.random_tip is None:
-    st.session_state.random_tip = random.choice(tips)
-
-# --- Prompt History Setup ---
-history_dir = Path("prompt_histories")
-history_dir.mkdir(exist_ok=True)
-history_path = history_dir / f"{st.session_state['user']}_prompt_history.csv"
-past_prompts = load_prompt_history(history_path)
-
-# --- Templates ---
-templates, _ = get_flat_templates()
-selected_template = st.session_state.get("selected_template", "")
-template_data = templates.get(selected_template, {})
-prefill = template_data if template_data else {}
+with profiling.phase("config"):
+    GOOGLE_API_KEY = st.secrets.get("GOOGLE_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    if not GOOGLE_API_KEY:
+        st.error("❌ GOOGLE_API_KEY not found.")
+        st.stop()
+
+    try:
+        model = get_model(GOOGLE_API_KEY)
+    except Exception as e:
+        st.error(f"Gemini model error: {e}")
+        st.stop()
+
+    response_cache = get_response_cache()
+    job_queue = get_job_queue()
+    st.sidebar.caption(
+        f"⚡ Cache: {response_cache.hits()} hits · {response_cache.stats['misses']} misses · "
+        f"{flights.stats['coalesced']} coalesced"
+    )
+
+with profiling.phase("assets"):
+    # --- Load Lottie ---
+    lottie_path = Path(__file__).parent / "idea.json"
+    if not lottie_path.exists():
+        lottie_path = Path("idea.json")
+    lottie_json = get_lottie(lottie_path)
+
+    # --- Tip Setup ---
+    if st.session_state.random_tip is None:
+        st.session_state.random_tip = random.choice(tips)
+
+    # --- Prompt History Setup ---
+    history_store = get_history_store()
+    history_count = history_store.count(st.session_state['user'])
+    goal_index = get_goal_index(history_store, st.session_state['user'])
+
+    # --- Templates ---
+    templates, _ = get_flat_templates()
+    selected_template = st.session_state.get("selected_template", "")
+    template_data = templates.get(selected_template, {})
+    prefill = template_data if template_data else {}
 
 # --- UI Render ---
-render_header()
-render_sidebar(lottie_json)
+with profiling.phase("render"):
+    render_header()
+    render_sidebar(lottie_json)
 
 # --- Voice Input ---
 st.markdown("### 🎙️ Or speak your idea:")
 audio_file = st.file_uploader("Upload voice note (.wav/.mp3)", type=["wav", "mp3"])
 transcribed_goal = ""
+# Spooled to disk once per upload; transcripts are cached by content hash and produced
+# off-thread, so touching other widgets never re-sends the audio. A transcription deletes its
+# spool when it is done, and one whose upload is removed is discarded.
+spooled = st.session_state.setdefault("spooled_audio", {})
+for file_id in [f for f in spooled if audio_file is None or f != audio_file.file_id]:
+    discard_audio(model, *spooled.pop(file_id))
 if audio_file is not None:
-    with st.spinner("Transcribing..."):
-        audio_bytes = audio_file.read()
-        try:
-            transcribe_prompt = "Transcribe this voice message into a clear goal for an AI prompt."
-            transcription = model.generate_content([transcribe_prompt, audio_bytes])
-            transcribed_goal = getattr(transcription, "text", "").strip()
-            st.success("Transcribed Goal:")
-            st.write(transcribed_goal)
-        except Exception as e:
-            st.error(f"Error transcribing audio: {e}")
+    if audio_file.file_id not in spooled:
+        spooled[audio_file.file_id] = spool_upload(audio_file)
+    digest, audio_path = spooled[audio_file.file_id]
+    transcription = transcribe_async(model, digest, audio_path)
+    if not transcription.done():
+        @st.fragment(run_every=1.0)
+        def transcription_status():
+            if transcription.done():
+                st.rerun()
+            st.info("🎙️ Transcribing in the background — you can keep filling in the form.")
+
+        transcription_status()
+    elif transcription.exception() is not None or not transcription.result():
+        if transcription.exception() is not None:
+            st.error(f"Error transcribing audio: {transcription.exception()}")
+        else:
+            st.warning("No speech was recognised in that recording.")
+        if st.button("🔁 Retry transcription"):
+            spooled[audio_file.file_id] = spool_upload(audio_file)
+            retry_transcription(model, digest)
+            st.rerun()
+    else:
+        transcribed_goal = transcription.result()
+        st.success("Transcribed Goal:")
+        st.write(transcribed_goal)
 
 # --- Form ---
 with st.form("prompt_form"):
@@ -105,84 +158,346 @@ with st.form("prompt_form"):
     save_txt = st.checkbox("💾 Save this to history?")
     depth = st.slider("🧬 Prompt Inception Depth", 1, 5, 1)
     god_mode = st.checkbox("🛐 Enable Prompt God Mode")
+    bypass_cache = st.checkbox("♻️ Bypass cache (regenerate)")
+    stream_output = st.checkbox("🌊 Stream output as it's written", value=True)
+
+    with st.expander("🧮 Matrix mode: compare tones × formats"):
+        matrix_tones = st.multiselect("Tones", valid_tones, default=valid_tones[:4])
+        matrix_formats = st.multiselect("Formats", output_types, default=output_types[:3])
+
+    col1, col2 = st.columns(2)
+    submitted = col1.form_submit_button("✨ Generate Prompt")
+    matrix_submitted = col2.form_submit_button("🧮 Generate Matrix")
+
+def show_result(result, params, save, extra=None):
+    st.download_button("📥 Download", result, file_name=f"prompt_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+
+    # Save last input for remix
+    st.session_state.last_prompt_params = params
+
+    # Feedback buttons
+    st.markdown("### ⭐ Rate this result:")
+    col1, col2 = st.columns(2)
+    if col1.button("👍 Like"):
+        st.toast("Thanks for the thumbs up!")
+    if col2.button("👎 Dislike"):
+        st.toast("We’ll try to do better!")
+
+    # Save to history
+    if save:
+        # extra (template, timings) is not a history column; stores ignore it, save listeners see it.
+        new_row = {"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **params, "prompt": result, **(extra or {})}
+        success = history_store.save(st.session_state['user'], new_row)
+        if success:
+            st.toast("💾 Saved to history")
+        else:
+            st.error("Failed to save history.")
+
+
+def run_generation(job, params, bypass):
+    # Runs on the job queue; chunks, finished inception stages and rate-limiter queue positions
+    # are published on the job. A stage's "chunks" marks where the next stage's stream starts.
+    timings = {}
+    stages = []
+
+    def on_stage(stage):
+        stages.append(dict(stage, chunks=len(job.progress()[0])))
+        job.update(stages=list(stages))
 
-    submitted = st.form_submit_button("✨ Generate Prompt")
+    text, from_cache, _ = run_inception(
+        model, params, bypass=bypass, on_chunk=job.publish,
+        on_stage=on_stage, on_queue=job.set_status, timings=timings,
+    )
+    return {"text": text, "from_cache": from_cache, "timings": timings, "stages": stages}
+
+
+def generate(params, save, bypass, stream):
+    # The job outlives this script run; its id in session state is how later reruns find it.
+    job_id = job_queue.submit("generate", run_generation, params, bypass)
+    st.session_state.generation = {
+        "job": job_id, "params": params, "save": save, "stream": stream,
+        "template": st.session_state.get("selected_template", ""),
+    }
+
+
+def render_stages(stages, depth):
+    # The trail of inception stages behind a prompt; nothing for a plain single-stage generation.
+    if depth <= 1 and not any(stage["scores"] for stage in stages):
+        return
+    for stage in stages:
+        notes = []
+        if stage["from_cache"]:
+            notes.append("⚡ cached")
+        if stage["similarity"] is not None:
+            notes.append(f"{stage['similarity']:.0%} similar to stage {stage['level'] - 1}")
+        if stage["scores"]:
+            notes.append(f"best of {len(stage['scores'])} branches (score {max(stage['scores']):.2f})")
+        if stage["converged"]:
+            notes.append("converged")
+        with st.expander(f"🧬 Stage {stage['level']} of {depth}" + (f" · {' · '.join(notes)}" if notes else "")):
+            st.markdown(stage["text"])
+
+
+def render_generation_progress(job_id, stream, depth):
+    # Polls the job without blocking the script; a finished job triggers a full rerun to collect it.
+    @st.fragment(run_every=0.5)
+    def progress():
+        job = job_queue.get(job_id)
+        if job is None or job.done:
+            st.rerun()
+        chunks, position, _ = job.progress()
+        stages = job.info.get("stages", [])
+        render_stages(stages, depth)
+        chunks = chunks[stages[-1]["chunks"]:] if stages else chunks
+        if position:
+            st.caption(f"⏳ The model is busy — you're #{position} in line")
+        elif stream and chunks:
+            st.markdown("".join(chunks) + " ▌")
+        elif depth > 1:
+            st.caption(f"⏳ Synthesizing stage {len(stages) + 1} of {depth}...")
+        else:
+            st.caption("⏳ Synthesizing your prompt...")
+
+    progress()
+
+
+if submitted or matrix_submitted:
+    params = {
+        "goal": goal,
+        "tone": tone,
+        "output_type": output_type,
+        "audience": audience,
+        "depth": depth,
+        "god_mode": god_mode,
+    }
 
 if submitted:
     if not goal.strip():
         st.error("Please enter a goal.")
     else:
-        with st.spinner("Synthesizing your prompt..."):
-            prompt_template = build_prompt(goal, tone, output_type, audience, depth, god_mode)
-            try:
-                response = model.generate_content(prompt_template)
-                result = getattr(response, "text", "").strip()
-
-                if not result:
-                    st.error("Empty response. Try again.")
-                    st.stop()
-
-                st.markdown("## 🌟 Your Prompt")
-                st.markdown(result)
-                st.download_button("📥 Download", result, file_name=f"prompt_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
-
-                # Save last input for remix
-                st.session_state.last_prompt_params = {
-                    "goal": goal,
-                    "tone": tone,
-                    "output_type": output_type,
-                    "audience": audience,
-                    "depth": depth,
-                    "god_mode": god_mode,
-                }
-
-                # Feedback buttons
-                st.markdown("### ⭐ Rate this result:")
-                col1, col2 = st.columns(2)
-                if col1.button("👍 Like"):
-                    st.toast("Thanks for the thumbs up!")
-                if col2.button("👎 Dislike"):
-                    st.toast("We’ll try to do better!")
-
-                # Save to history
-                if save_txt:
-                    new_row = {
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "goal": goal,
-                        "tone": tone,
-                        "output_type": output_type,
-                        "audience": audience,
-                        "prompt": result
-                    }
-                    success = save_prompt_history(history_path, new_row)
-                    if success:
-                        st.toast("💾 Saved to history")
-                    else:
-                        st.error("Failed to save history.")
-
-            except Exception as e:
-                st.error(f"Error during generation: {e}")
+        match = None if bypass_cache else goal_index.find(goal, tone, output_type)
+        if match:
+            # Hold the request until the user picks reuse or a fresh generation.
+            st.session_state.near_duplicate = {
+                "params": params, "save": save_txt, "stream": stream_output,
+                "score": match[0], "key": match[1],
+            }
+        else:
+            st.session_state.pop("near_duplicate", None)
+            generate(params, save_txt, bypass_cache, stream_output)
+
+# --- Near-Duplicate Reuse ---
+if "near_duplicate" in st.session_state:
+    pending = st.session_state.near_duplicate
+    notice = st.empty()
+    with notice.container():
+        st.info(
+            f"🔁 You already generated something very close to this ({pending['score']:.0%} similar): "
+            f"saved {pending['key']['timestamp']} · {pending['key']['tone']} · {pending['key']['output_type']}"
+        )
+        col1, col2 = st.columns(2)
+        reuse = col1.button("♻️ Reuse it")
+        regenerate = col2.button("✨ Generate anyway")
+    if reuse or regenerate:
+        del st.session_state.near_duplicate
+        notice.empty()
+    row = fetch_row(history_store, st.session_state['user'], pending["key"]) if reuse else None
+    if row:
+        st.session_state.generation = {
+            "params": pending["params"], "save": False,
+            "result": {"text": row["prompt"], "reused": row["timestamp"]},
+        }
+    elif reuse:
+        st.warning("That prompt is no longer in your history, so here is a fresh one.")
+        generate(pending["params"], pending["save"], True, pending["stream"])
+    elif regenerate:
+        generate(pending["params"], pending["save"], True, pending["stream"])
+
+# --- Current Result ---
+# Kept in session state until the next submission, so clicks elsewhere neither lose nor repeat it.
+if "generation" in st.session_state:
+    current = st.session_state.generation
+    if "result" not in current and "error" not in current:
+        job = job_queue.get(current["job"])
+        if job is None:
+            st.warning("That generation is no longer available. Please submit it again.")
+            del st.session_state.generation
+        elif job.done:
+            job_queue.consume(job.id)
+            if job.error is not None:
+                current["error"] = str(job.error)
+            elif not job.result["text"]:
+                current["error"] = "Empty response. Try again."
+            else:
+                current["result"] = job.result
+    if "generation" in st.session_state:
+        st.markdown("## 🌟 Your Prompt")
+        if "error" in current:
+            st.error(f"Error during generation: {current['error']}")
+        elif "result" not in current:
+            render_generation_progress(current["job"], current["stream"], current["params"]["depth"])
+        else:
+            result = current["result"]
+            render_stages(result.get("stages", []), current["params"]["depth"])
+            st.markdown(result["text"])
+            if result.get("reused"):
+                st.caption(f"♻️ Reused from your history ({result['reused']})")
+            elif result["from_cache"]:
+                st.caption("⚡ Served from cache — tick \"Bypass cache\" to regenerate.")
+            else:
+                timings = st.session_state.last_generation_timings = result["timings"]
+                st.caption(f"⏱️ First token {timings['first_token_ms']:.0f} ms · total {timings['total_ms']:.0f} ms")
+            extra = {"template": current.get("template", "")}
+            if not result.get("reused") and not result["from_cache"]:
+                extra.update(result["timings"])
+            show_result(result["text"], current["params"], current["save"] and not current.get("saved"), extra)
+            current["saved"] = True
+
 
 # --- Remix Feature ---
-if "last_prompt_params" in st.session_state and st.button("🔁 Remix This Prompt"):
-    remix = st.session_state.last_prompt_params.copy()
-    remix["tone"] = random.choice([t for t in valid_tones if t != remix["tone"]])
-    remix["output_type"] = random.choice([o for o in output_types if o != remix["output_type"]])
-
-    with st.spinner("Remixing your prompt..."):
-        remix_prompt = build_prompt(**remix)
-        remix_response = model.generate_content(remix_prompt)
-        remix_text = getattr(remix_response, "text", "").strip()
-
-        if remix_text:
-            st.markdown("### 🎲 Remixed Prompt")
+def run_variants(job, variants, max_concurrency):
+    # Shared by remix and matrix mode; publishes (index, (text, error)) as each variant finishes.
+    def run_one(variant):
+        return run_inception(model, variant)[0]
+
+    outcomes = {}
+    for index, text, error in run_concurrently(run_one, variants, max_concurrency):
+        outcomes[index] = (text, str(error) if error else None)
+        job.publish((index, outcomes[index]))
+    return outcomes
+
+
+def render_remix(variants, outcomes):
+    for index, variant in enumerate(variants):
+        st.markdown(f"**🎭 {variant['tone']} · 🧾 {variant['output_type']}**")
+        remix_text, error = outcomes.get(index, (None, None))
+        if index not in outcomes:
+            st.caption("Remixing...")
+        elif error:
+            st.error(f"Error during remix: {error}")
+        elif remix_text:
             st.markdown(remix_text)
+        else:
+            st.warning("Empty response.")
+
+
+if "last_prompt_params" in st.session_state:
+    variant_count = st.slider("🎲 Remix variants", 1, 8, REMIX_MAX_CONCURRENCY)
+    if st.button("🔁 Remix This Prompt"):
+        variants = remix_variants(st.session_state.last_prompt_params, variant_count)
+        st.session_state.remix = {
+            "job": job_queue.submit("remix", run_variants, variants, REMIX_MAX_CONCURRENCY), "variants": variants,
+        }
+
+if "remix" in st.session_state:
+    remix = st.session_state.remix
+    if "outcomes" not in remix:
+        job = job_queue.get(remix["job"])
+        if job is None:
+            del st.session_state.remix
+        elif job.done:
+            job_queue.consume(job.id)
+            remix["outcomes"] = job.result if job.error is None else {
+                index: (None, str(job.error)) for index in range(len(remix["variants"]))
+            }
+    if "remix" in st.session_state:
+        st.markdown("### 🎲 Remixed Prompts")
+        if "outcomes" in remix:
+            render_remix(remix["variants"], remix["outcomes"])
+        else:
+            @st.fragment(run_every=0.5)
+            def remix_progress():
+                job = job_queue.get(remix["job"])
+                if job is None or job.done:
+                    st.rerun()
+                render_remix(remix["variants"], dict(job.progress()[0]))
+
+            remix_progress()
+
+# --- Matrix Mode ---
+if matrix_submitted:
+    if not goal.strip():
+        st.error("Please enter a goal.")
+    elif not matrix_tones or not matrix_formats:
+        st.error("Pick at least one tone and one format for the matrix.")
+    else:
+        # Every cell's prompt is rendered up front; cells with identical prompts share one call.
+        cells, variants = matrix_variants(params, matrix_tones, matrix_formats)
+        st.session_state.matrix = {
+            "job": job_queue.submit("matrix", run_variants, variants, MATRIX_MAX_CONCURRENCY),
+            "params": params, "formats": matrix_formats, "cells": cells, "variants": variants,
+            "template": st.session_state.get("selected_template", ""),
+        }
+
+
+def render_matrix(matrix, outcomes):
+    formats = matrix["formats"]
+    for start in range(0, len(matrix["cells"]), len(formats)):
+        for column, (tone, output_type, index) in zip(st.columns(len(formats)), matrix["cells"][start:start + len(formats)]):
+            with column.container(height=320):
+                st.markdown(f"**🎭 {tone} · 🧾 {output_type}**")
+                text, error = outcomes.get(index, (None, None))
+                if index not in outcomes:
+                    st.caption("Generating...")
+                elif error:
+                    st.error(f"Error: {error}")
+                elif text:
+                    st.markdown(text)
+                else:
+                    st.warning("Empty response.")
+
+
+if "matrix" in st.session_state:
+    matrix = st.session_state.matrix
+    if "outcomes" not in matrix:
+        job = job_queue.get(matrix["job"])
+        if job is None:
+            del st.session_state.matrix
+        elif job.done:
+            job_queue.consume(job.id)
+            matrix["outcomes"] = job.result if job.error is None else {
+                index: (None, str(job.error)) for index in range(len(matrix["variants"]))
+            }
+    if "matrix" in st.session_state:
+        st.markdown("### 🧮 Prompt Matrix")
+        shared = len(matrix["cells"]) - len(matrix["variants"])
+        if shared:
+            st.caption(f"{shared} cell(s) rendered the same prompt as another and share its result.")
+        if "outcomes" in matrix:
+            render_matrix(matrix, matrix["outcomes"])
+            rows = [
+                {"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                 **dict(matrix["params"], tone=tone, output_type=output_type),
+                 "prompt": matrix["outcomes"][index][0], "template": matrix["template"]}
+                for tone, output_type, index in matrix["cells"] if matrix["outcomes"][index][0]
+            ]
+            if rows and st.button(f"💾 Save all {len(rows)} to history", disabled=matrix.get("saved", False)):
+                # One bulk write for the whole grid; the flag keeps reruns from saving it twice.
+                if history_store.save_many(st.session_state['user'], rows):
+                    matrix["saved"] = True
+                    st.toast(f"💾 Saved {len(rows)} prompts to history")
+                else:
+                    st.error("Failed to save history.")
+        else:
+            @st.fragment(run_every=0.5)
+            def matrix_progress():
+                job = job_queue.get(matrix["job"])
+                if job is None or job.done:
+                    st.rerun()
+                outcomes = dict(job.progress()[0])
+                st.progress(len(outcomes) / len(matrix["variants"]),
+                            text=f"{len(outcomes)} of {len(matrix['variants'])} generated")
+                render_matrix(matrix, outcomes)
+
+            matrix_progress()
 
 # --- Prompt History Viewer ---
-if not past_prompts.empty:
+if history_count:
     st.markdown("## 🕰️ Prompt History")
     with st.expander("View saved prompts"):
-        st.dataframe(past_prompts, use_container_width=True)
-        st.download_button("📂 Download History CSV", past_prompts.to_csv(index=False), file_name="prompt_history.csv")
+        render_history(history_store, st.session_state['user'])
+        render_export(history_store, st.session_state['user'])
 
 render_footer()
+profiling.report()
+perf.end_request()
@@ -0,0 +1,207 @@
+import argparse
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from utils.constants import history_columns
+from utils.history import file_lock, read_rows, write_rows
+
+# Columnar archive for older history rows, next to the CSV that keeps taking appends:
+#   MAGIC | u32 header length | JSON header | column sections
+# timestamp is a fixed-width byte array, tone/output_type/audience are dictionary codes
+# (uint8 for the usual vocabularies), and goal/prompt are zlib blocks of BLOCK_ROWS texts.
+# Rows are sorted by timestamp. The header's cutoff says which CSV rows are already archived
+# (timestamp < cutoff), so a crash between writing the archive and trimming the CSV
+# never shows a row twice.
+MAGIC = b"PSARCH1\n"
+ARCHIVE_SUFFIX = ".archive"
+ARCHIVE_AFTER_DAYS = int(os.getenv("HISTORY_ARCHIVE_AFTER_DAYS", 30))
+BLOCK_ROWS = 64
+BLOCK_CACHE = 32
+DICTIONARY_COLUMNS = ("tone", "output_type", "audience")
+TEXT_COLUMNS = ("goal", "prompt")
+
+_open = {}
+_open_lock = threading.Lock()
+
+
+def archive_path_for(csv_path):
+    return Path(csv_path).with_suffix(ARCHIVE_SUFFIX)
+
+
+def _text(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return str(value)
+
+
+def _codes_dtype(count):
+    return np.uint8 if count <= 1 << 8 else np.uint16 if count <= 1 << 16 else np.uint32
+
+
+def write_archive(path, rows, cutoff):
+    sections = []
+    size = 0
+
+    def add(data):
+        nonlocal size
+        sections.append(data)
+        size += len(data)
+        return size - len(data)
+
+    columns = {}
+    stamps = [_text(row.get("timestamp")).encode("utf-8") for row in rows]
+    width = max(map(len, stamps), default=0) or 1
+    columns["timestamp"] = {"kind": "fixed", "width": width,
+                            "offset": add(np.array(stamps, dtype=f"S{width}").tobytes())}
+    for col in DICTIONARY_COLUMNS:
+        values = sorted({_text(row.get(col)) for row in rows})
+        lookup = {value: code for code, value in enumerate(values)}
+        dtype = _codes_dtype(len(values))
+        codes = np.fromiter((lookup[_text(row.get(col))] for row in rows), dtype=dtype, count=len(rows))
+        columns[col] = {"kind": "dict", "values": values, "dtype": np.dtype(dtype).name, "offset": add(codes.tobytes())}
+    for col in TEXT_COLUMNS:
+        blocks = []
+        for start in range(0, len(rows), BLOCK_ROWS):
+            texts = [_text(row.get(col)) for row in rows[start:start + BLOCK_ROWS]]
+            data = zlib.compress(json.dumps(texts).encode("utf-8"), 6)
+            blocks.append([add(data), len(data)])
+        columns[col] = {"kind": "blocks", "block_rows": BLOCK_ROWS, "blocks": blocks}
+
+    header = json.dumps({"rows": len(rows), "cutoff": cutoff, "columns": columns}).encode("utf-8")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        for data in sections:
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class HistoryArchive:
+    # Read-only view over a memory-mapped archive; only the columns (and, for text columns,
+    # the blocks) a caller asks for are decoded.
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a history archive")
+        (header_len,) = struct.unpack_from("<I", self._mm, len(MAGIC))
+        self._base = len(MAGIC) + 4 + header_len
+        header = json.loads(self._mm[len(MAGIC) + 4:self._base])
+        self.rows = header["rows"]
+        self.cutoff = header["cutoff"]
+        self._columns = header["columns"]
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.rows
+
+    def _array(self, dtype, offset):
+        return np.frombuffer(self._mm, dtype=dtype, count=self.rows, offset=self._base + offset)
+
+    def _block(self, col, index):
+        key = (col, index)
+        with self._lock:
+            if key in self._blocks:
+                self._blocks.move_to_end(key)
+                return self._blocks[key]
+        offset, length = self._columns[col]["blocks"][index]
+        start = self._base + offset
+        texts = json.loads(zlib.decompress(self._mm[start:start + length]))
+        with self._lock:
+            self._blocks[key] = texts
+            while len(self._blocks) > BLOCK_CACHE:
+                self._blocks.popitem(last=False)
+        return texts
+
+    def span(self, start=None, end=None):
+        # (first, last) row positions with start <= timestamp < end, searched on the raw column.
+        spec = self._columns["timestamp"]
+        stamps = self._array(f"S{spec['width']}", spec["offset"])
+        first = int(np.searchsorted(stamps, start.encode("utf-8"))) if start else 0
+        last = int(np.searchsorted(stamps, end.encode("utf-8"))) if end else self.rows
+        return first, max(first, last)
+
+    def column(self, col, positions=None):
+        # Values for the given row positions (all rows if None), as a list or numpy array.
+        spec = self._columns[col]
+        positions = np.arange(self.rows) if positions is None else np.asarray(positions, dtype=np.int64)
+        if spec["kind"] == "fixed":
+            return self._array(f"S{spec['width']}", spec["offset"])[positions].astype(str)
+        if spec["kind"] == "dict":
+            values = np.array(spec["values"], dtype=object)
+            return values[self._array(spec["dtype"], spec["offset"])[positions]]
+        rows_per_block = spec["block_rows"]
+        return [self._block(col, p // rows_per_block)[p % rows_per_block] for p in positions.tolist()]
+
+    def frame(self, columns=history_columns, positions=None):
+        import pandas as pd
+        return pd.DataFrame({col: self.column(col, positions) for col in columns}, columns=list(columns))
+
+    def records(self, positions=None):
+        columns = [self.column(col, positions) for col in history_columns]
+        return [dict(zip(history_columns, map(str, values))) for values in zip(*columns)]
+
+
+def open_archive(path):
+    # One mapping per file, reused until the file is replaced (inode, mtime or size change).
+    path = Path(path)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _open_lock:
+        cached = _open.get(path)
+        if cached is None or cached[0] != signature:
+            cached = _open[path] = (signature, HistoryArchive(path))
+        return cached[1]
+
+
+def archive_history(csv_path, days=ARCHIVE_AFTER_DAYS, now=None):
+    # Moves CSV rows older than `days` into the archive; returns how many rows moved.
+    csv_path = Path(csv_path)
+    path = archive_path_for(csv_path)
+    cutoff = f"{(now or datetime.now()) - timedelta(days=days):%Y-%m-%d}"
+    with file_lock(csv_path):
+        if not csv_path.exists():
+            return 0
+        existing = open_archive(path)
+        previous_cutoff = existing.cutoff if existing else ""
+        rows = read_rows(csv_path)
+        # Rows below the previous cutoff are already archived (a crash before the CSV was trimmed).
+        moving = [row for row in rows if previous_cutoff <= row.get("timestamp", "") < cutoff]
+        recent = [row for row in rows if row.get("timestamp", "") >= max(cutoff, previous_cutoff)]
+        if moving:
+            archived = existing.records() if existing else []
+            merged = sorted(archived + moving, key=lambda row: _text(row.get("timestamp")))
+            write_archive(path, merged, max(cutoff, previous_cutoff))
+        if len(recent) != len(rows):
+            write_rows(csv_path, recent)
+    return len(moving)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move older prompt history rows into columnar archives.")
+    parser.add_argument("paths", nargs="*", help="history CSVs (default: prompt_histories/*_prompt_history.csv)")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="archive rows older than this")
+    args = parser.parse_args()
+    for csv_path in args.paths or sorted(Path("prompt_histories").glob("*_prompt_history.csv")):
+        before = Path(csv_path).stat().st_size
+        moved = archive_history(csv_path, args.days)
+        archive = archive_path_for(csv_path)
+        archived = archive.stat().st_size if archive.exists() else 0
+        print(f"{csv_path}: {moved} rows archived · csv {before:,} -> {Path(csv_path).stat().st_size:,} bytes · "
+              f"archive {archived:,} bytes")
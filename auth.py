@@ -1,6 +1,13 @@
 
+import os
+
 import streamlit as st
 
+def admin_users():
+    # Users allowed to see operator-only panels such as the perf metrics; read per call, so a
+    # .env loaded after this import still counts.
+    return {u.strip() for u in os.getenv("ADMIN_USERS", "").split(",") if u.strip()}
+
 def init_session_state():
     if 'user' not in st.session_state:
         st.session_state['user'] = None
@@ -27,3 +34,6 @@ def login():
 def logout():
     st.session_state['user'] = None
     st.rerun()
+
+def is_admin(user):
+    return user in admin_users()
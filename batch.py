@@ -0,0 +1,155 @@
+import argparse
+import csv
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# First of all: generation, models and inception read their settings at import time.
+load_dotenv()
+
+from utils.constants import history_columns, valid_tones, output_types
+from utils.generation import run_concurrently
+from utils.history import encode_rows
+from utils.inception import run_inception
+from utils.models import create_model
+
+# The form's inception depth range; every level is one more sequential model call per row.
+MAX_DEPTH = 5
+
+
+class RateLimiter:
+    # Spaces calls at least 1/rate seconds apart across threads; rate <= 0 disables it.
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def read_goals(path):
+    # Streams rows from a .csv or .jsonl file without loading it whole.
+    path = Path(path)
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.suffix.lower() in (".jsonl", ".ndjson"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def normalize_row(row):
+    # Raises ValueError for a row that can't be run, e.g. a depth that isn't a number.
+    try:
+        depth = int(str(row.get("depth") or 1).strip())
+    except ValueError:
+        raise ValueError(f"invalid depth {row.get('depth')!r}") from None
+    tone = row.get("tone") or valid_tones[0]
+    output_type = row.get("output_type") or output_types[0]
+    return {
+        "goal": (row.get("goal") or "").strip(),
+        "tone": tone if tone in valid_tones else valid_tones[0],
+        "output_type": output_type if output_type in output_types else output_types[0],
+        "audience": row.get("audience") or "",
+        "depth": min(max(depth, 1), MAX_DEPTH),
+        "god_mode": str(row.get("god_mode", "")).strip().lower() in ("1", "true", "yes", "on"),
+    }
+
+
+def load_checkpoint(path):
+    # (done row indexes, output size after the last of them). Each line is "index end"; lines
+    # from older runs hold only the index, and leave the size unknown.
+    done, end = set(), None
+    if not path.exists():
+        return done, end
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                index, _, offset = line.partition(" ")
+                done.add(int(index))
+                end = int(offset) if offset.strip() else end
+    return done, end
+
+
+def write_result(out_path, record):
+    # Appends one result; returns the output's size after it.
+    with open(out_path, "ab") as f:
+        if out_path.suffix.lower() == ".csv":
+            f.write(encode_rows([record], header=f.tell() == 0))
+        else:
+            f.write((json.dumps({col: record[col] for col in history_columns}) + "\n").encode("utf-8"))
+        return f.tell()
+
+
+def run_batch(input_path, output_path, model, concurrency=4, rate=0.0, use_cache=True):
+    # Rows run on a pool of their own, so --concurrency is not capped by GENERATION_WORKERS.
+    output_path = Path(output_path)
+    checkpoint_path = Path(f"{output_path}.checkpoint")
+    done, end = load_checkpoint(checkpoint_path)
+    if end is not None and output_path.exists() and output_path.stat().st_size > end:
+        # A result written before an interruption kept its checkpoint line from landing; it is
+        # dropped here and generated again, instead of appearing twice.
+        with open(output_path, "r+b") as f:
+            f.truncate(end)
+    limiter = RateLimiter(rate)
+    stats = {"generated": 0, "skipped": len(done), "failed": 0}
+
+    def pending_rows():
+        for index, row in enumerate(read_goals(input_path)):
+            if index not in done:
+                yield index, row
+
+    def generate(item):
+        index, row = item
+        params = normalize_row(row)
+        if not params["goal"]:
+            raise ValueError("empty goal")
+        limiter.wait()
+        text = run_inception(model, params, bypass=not use_cache)[0]
+        if not text:
+            raise ValueError("empty response")
+        return index, dict(params, prompt=text, timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint, \
+            ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch") as pool:
+        for _, result, error in run_concurrently(generate, pending_rows(), concurrency, pool):
+            if error:
+                stats["failed"] += 1
+                print(f"failed: {error}", file=sys.stderr)
+                continue
+            index, record = result
+            checkpoint.write(f"{index} {write_result(output_path, record)}\n")
+            checkpoint.flush()
+            stats["generated"] += 1
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate prompts for every goal in a CSV or JSONL file.")
+    parser.add_argument("input", help="CSV or JSONL with goal[, tone, output_type, audience, depth, god_mode]")
+    parser.add_argument("output", help="results file; .csv or .jsonl, appended to and resumable")
+    parser.add_argument("--model", default=None, help='Gemini model name, or "fake" to run offline')
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=0.0, help="max requests per second (0 = unlimited)")
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    stats = run_batch(args.input, args.output, create_model(args.model), args.concurrency, args.rate, not args.no_cache)
+    print(f"{stats['generated']} generated, {stats['skipped']} already done, "
+          f"{stats['failed']} failed in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,145 @@
+import argparse
+import csv
+import fnmatch
+import heapq
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from pathlib import Path
+
+from utils.constants import history_columns
+from utils.history_store import HISTORY_DIR, IMPORT_BATCH, CSVHistoryStore, SQLiteHistoryStore
+
+# Admin tool: scans every per-user history (CSV tail + archive) on a process pool and
+# stream-merges the results into one time-ordered CSV, JSONL or SQLite file. Each task streams a
+# batch of users and sorts their rows into run files of at most RUN_ROWS rows; the parent merges
+# the runs with a heap, so memory holds RUN_ROWS rows per worker plus one row per run.
+USERS_PER_TASK = 64
+RUN_ROWS = int(os.getenv("CONSOLIDATE_RUN_ROWS", 100_000))
+OUTPUT_COLUMNS = ["user"] + history_columns
+
+
+def _write_run(rows, run_path):
+    rows.sort(key=lambda row: (row["timestamp"], row["user"]))
+    with open(run_path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+def _scan_batch(history_dir, users, since, until, run_prefix):
+    # Runs in a worker process; returns (run paths, rows written). Each run is sorted by (timestamp, user).
+    store = CSVHistoryStore(history_dir)
+    filters = {"start": since, "end": until}
+    runs, rows, total = [], [], 0
+    for user in users:
+        for row in store.iter_rows(user, filters):
+            rows.append({"user": user, **{col: "" if row.get(col) is None else str(row[col]) for col in history_columns}})
+            if len(rows) >= RUN_ROWS:
+                runs.append(f"{run_prefix}-{len(runs)}.jsonl")
+                _write_run(rows, runs[-1])
+                total += len(rows)
+                rows = []
+    if rows:
+        runs.append(f"{run_prefix}-{len(runs)}.jsonl")
+        _write_run(rows, runs[-1])
+        total += len(rows)
+    return runs, total
+
+
+def _read_run(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def iter_consolidated(history_dir=HISTORY_DIR, since=None, until=None, users=None, workers=None, stats=None):
+    # Yields every matching row ({"user", *history_columns}) across users in timestamp order.
+    # since/until are inclusive dates; users is a list of names or glob patterns.
+    stats = {} if stats is None else stats
+    names = CSVHistoryStore(history_dir).users()
+    if users:
+        names = [name for name in names if any(fnmatch.fnmatchcase(name, pattern) for pattern in users)]
+    batches = [names[i:i + USERS_PER_TASK] for i in range(0, len(names), USERS_PER_TASK)]
+    stats.update(users=len(names), tasks=len(batches), rows=0)
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="consolidate-") as run_dir:
+        runs = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_scan_batch, str(history_dir), batch, since, until, os.path.join(run_dir, f"run-{i}"))
+                for i, batch in enumerate(batches)
+            ]
+            for future in as_completed(futures):
+                paths, count = future.result()
+                runs += paths
+                stats["rows"] += count
+        stats["scan_seconds"] = time.perf_counter() - started
+        started = time.perf_counter()
+        yield from heapq.merge(*map(_read_run, sorted(runs)), key=lambda row: (row["timestamp"], row["user"]))
+        stats["merge_seconds"] = time.perf_counter() - started
+
+
+def write_output(rows, output):
+    # Format follows the suffix: .csv, .jsonl, or .db/.sqlite (a new SQLiteHistoryStore; an existing
+    # database is refused rather than appended to, which would duplicate its rows).
+    output = Path(output)
+    written = 0
+    if output.suffix in (".db", ".sqlite"):
+        if output.exists():
+            raise FileExistsError(f"{output} already exists; consolidate into a new database")
+        store = SQLiteHistoryStore(output)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= IMPORT_BATCH:
+                store.insert_rows(batch)
+                written += len(batch)
+                batch = []
+        store.insert_rows(batch)
+        return written + len(batch)
+    with open(output, "w", encoding="utf-8", newline="") as f:
+        if output.suffix == ".jsonl":
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+                written += 1
+        else:
+            writer = csv.DictWriter(f, fieldnames=OUTPUT_COLUMNS, lineterminator="\n")
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                written += 1
+    return written
+
+
+def consolidate(output, history_dir=HISTORY_DIR, since=None, until=None, users=None, workers=None):
+    stats = {}
+    started = time.perf_counter()
+    stats["written"] = write_output(iter_consolidated(history_dir, since, until, users, workers, stats), output)
+    stats["seconds"] = time.perf_counter() - started
+    stats["rows_per_sec"] = stats["written"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge every user's prompt history into one time-ordered file.")
+    parser.add_argument("output", help="destination .csv, .jsonl or .db")
+    parser.add_argument("--history-dir", default=HISTORY_DIR)
+    parser.add_argument("--since", type=date.fromisoformat, help="first day to include (YYYY-MM-DD)")
+    parser.add_argument("--until", type=date.fromisoformat, help="last day to include (YYYY-MM-DD)")
+    parser.add_argument("--user", dest="users", action="append", help="user name or glob; repeatable")
+    parser.add_argument("--workers", type=int, default=None, help="scan processes (default: CPU count)")
+    args = parser.parse_args()
+    try:
+        stats = consolidate(args.output, args.history_dir, args.since, args.until, args.users, args.workers)
+    except FileExistsError as e:
+        parser.error(str(e))
+    print(
+        f"{stats['users']} users in {stats['tasks']} tasks · {stats['written']:,} rows -> {args.output} · "
+        f"scan {stats['scan_seconds']:.2f} s · merge+write {stats['merge_seconds']:.2f} s · "
+        f"{stats['rows_per_sec']:,.0f} rows/s",
+        file=sys.stderr,
+    )
@@ -35,3 +35,5 @@ tips = [
     "Request reasoning when clarity matters.",
     "Use follow-ups to test prompt strength."
 ]
+
+history_columns = ["timestamp", "goal", "tone", "output_type", "audience", "prompt"]
@@ -0,0 +1,96 @@
+import argparse
+import csv
+import io
+import json
+import sys
+import tempfile
+import zlib
+from datetime import date
+
+from utils.constants import history_columns
+from utils.history_store import get_history_store
+
+# History export, streamed from the store's iter_rows: rows are encoded CHUNK_ROWS at a time and,
+# for the gzip variants, fed through one compressor, so memory does not grow with the history.
+#   python -m utils.export demo history.jsonl.gz --since 2026-01-01 --fields timestamp,goal,prompt
+EXPORT_FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+CHUNK_ROWS = 500
+# The in-app download spools to disk past this size instead of holding the export in memory.
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+
+def export_filename(fmt, compress=False, stem="prompt_history"):
+    return f"{stem}.{fmt}" + (".gz" if compress else "")
+
+
+def export_mime(fmt, compress=False):
+    return "application/gzip" if compress else EXPORT_FORMATS[fmt]
+
+
+def export_chunks(rows, fmt="csv", fields=None, compress=False):
+    # Yields the encoded export as bytes chunks; with compress, the chunks form one gzip stream.
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}")
+    fields = list(fields or history_columns)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    buf = io.StringIO()
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(buf, fieldnames=fields, extrasaction="ignore", lineterminator="\n")
+        writer.writeheader()
+
+    def drain():
+        data = buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+        return compressor.compress(data) if compressor else data
+
+    for count, row in enumerate(rows, 1):
+        record = {field: "" if row.get(field) is None else row[field] for field in fields}
+        if writer:
+            writer.writerow(record)
+        else:
+            buf.write(json.dumps(record, ensure_ascii=False) + "\n")
+        if count % CHUNK_ROWS == 0 and (chunk := drain()):
+            yield chunk
+    chunk = drain() + (compressor.flush() if compressor else b"")
+    if chunk:
+        yield chunk
+
+
+def export_history(store, user, fmt="csv", fields=None, filters=None, compress=False):
+    return export_chunks(store.iter_rows(user, filters), fmt, fields, compress)
+
+
+def spool_export(store, user, fmt="csv", fields=None, filters=None, compress=False):
+    # A file object holding the finished export, for st.download_button's deferred data callable.
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    for chunk in export_history(store, user, fmt, fields, filters, compress):
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream one user's prompt history to a file.")
+    parser.add_argument("user")
+    parser.add_argument("output", help="destination path, or - for stdout; format follows the suffix")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, help="default: from the output suffix, else csv")
+    parser.add_argument("--gzip", action="store_true", help="compress (implied by a .gz suffix)")
+    parser.add_argument("--since", type=date.fromisoformat, help="first day to include (YYYY-MM-DD)")
+    parser.add_argument("--until", type=date.fromisoformat, help="last day to include (YYYY-MM-DD)")
+    parser.add_argument("--fields", help=f"comma-separated subset of {','.join(history_columns)}")
+    args = parser.parse_args()
+
+    name = args.output.removesuffix(".gz")
+    fmt = args.format or next((f for f in EXPORT_FORMATS if name.endswith(f".{f}")), "csv")
+    compress = args.gzip or args.output.endswith(".gz")
+    fields = args.fields.split(",") if args.fields else None
+    if fields and set(fields) - set(history_columns):
+        parser.error(f"unknown fields: {', '.join(sorted(set(fields) - set(history_columns)))}")
+    chunks = export_history(get_history_store(), args.user, fmt, fields,
+                            {"start": args.since, "end": args.until}, compress)
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    with out:
+        for chunk in chunks:
+            out.write(chunk)
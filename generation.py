@@ -0,0 +1,103 @@
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils import perf
+from utils.constants import valid_tones, output_types
+from utils.helpers import build_prompt
+
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", 16))
+REMIX_MAX_CONCURRENCY = int(os.getenv("REMIX_MAX_CONCURRENCY", 5))
+# Enough to run a full 4 tones × 3 formats sweep at once, so it takes about as long as its slowest call.
+MATRIX_MAX_CONCURRENCY = int(os.getenv("MATRIX_MAX_CONCURRENCY", 12))
+
+_executor = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="generate")
+
+
+def chunk_text(chunk):
+    # Blocked or empty candidates raise on .text instead of returning "".
+    try:
+        return chunk.text or ""
+    except (AttributeError, ValueError):
+        return ""
+
+
+def stream_generate(model, prompt_text, timings=None, **kwargs):
+    # Yields text chunks as they arrive; fills timings with first-token and total latency in ms.
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    for chunk in model.generate_content(prompt_text, stream=True, **kwargs):
+        text = chunk_text(chunk)
+        if not text:
+            continue
+        timings.setdefault("first_token_ms", (time.perf_counter() - start) * 1000)
+        yield text
+    timings["total_ms"] = (time.perf_counter() - start) * 1000
+    perf.record("generate.first_token", timings.get("first_token_ms", timings["total_ms"]) / 1000)
+
+
+@perf.timed("generate")
+def generate_text(model, prompt_text, on_chunk=None, timings=None, on_wait=None):
+    # Full response text; with on_chunk set the response is streamed and each chunk passed along.
+    # on_wait(position) reports the caller's place in the rate limiter's queue; it is dropped
+    # for an unthrottled model (MODEL_RATE_LIMIT=0), whose generate_content doesn't take it.
+    timings = {} if timings is None else timings
+    kwargs = {"on_wait": on_wait} if on_wait and getattr(model, "reports_queue", False) else {}
+    if on_chunk is None:
+        start = time.perf_counter()
+        text = chunk_text(model.generate_content(prompt_text, **kwargs))
+        timings["total_ms"] = timings["first_token_ms"] = (time.perf_counter() - start) * 1000
+        return text.strip()
+    parts = []
+    for text in stream_generate(model, prompt_text, timings, **kwargs):
+        parts.append(text)
+        on_chunk(text)
+    return "".join(parts).strip()
+
+
+def run_concurrently(fn, items, max_concurrency, executor=None):
+    # Runs fn over items on the shared pool (or executor), at most max_concurrency at a time.
+    # Items are pulled lazily; yields (index, result, error) in completion order. Work already
+    # running on a pool must not fan out onto that same pool: it can wait on itself forever.
+    pending = {}
+    queue = enumerate(items)
+    exhausted = False
+    while not exhausted or pending:
+        while not exhausted and len(pending) < max(1, max_concurrency):
+            try:
+                index, item = next(queue)
+            except StopIteration:
+                exhausted = True
+                break
+            pending[(executor or _executor).submit(fn, item)] = index
+        if not pending:
+            break
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = pending.pop(future)
+            error = future.exception()
+            yield index, None if error else future.result(), error
+
+
+def remix_variants(params, count, rng=random):
+    # Distinct tone/format pairs that differ from the original on both axes.
+    pairs = [(tone, output_type) for tone in valid_tones for output_type in output_types
+             if tone != params["tone"] and output_type != params["output_type"]]
+    return [dict(params, tone=tone, output_type=output_type)
+            for tone, output_type in rng.sample(pairs, min(count, len(pairs)))]
+
+
+def matrix_variants(params, tones, formats):
+    # One cell per tone × format pair, in row-major order, plus the distinct variants to run:
+    # cells that render the same build_prompt text share one call. Returns (cells, variants),
+    # where cells[i] is (tone, output_type, index into variants).
+    cells, variants, seen = [], [], {}
+    for tone in tones:
+        for output_type in formats:
+            variant = dict(params, tone=tone, output_type=output_type)
+            index = seen.setdefault(build_prompt(**variant), len(variants))
+            if index == len(variants):
+                variants.append(variant)
+            cells.append((tone, output_type, index))
+    return cells, variants
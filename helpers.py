@@ -1,9 +1,12 @@
 
 import json
 from pathlib import Path
-import pandas as pd
 from datetime import datetime
 
+from utils import perf
+from utils.history import append_row, load_snapshot
+
+@perf.timed("lottie.load")
 def load_lottiefile(filepath: str):
     try:
         with open(filepath, "r", encoding="utf-8") as f:
@@ -11,21 +14,24 @@ def load_lottiefile(filepath: str):
     except Exception as e:
         return {}
 
+@perf.timed("history.load")
 def load_prompt_history(history_path):
+    # Served from the process-wide snapshot; the file is only parsed again after it changes.
     try:
-        return pd.read_csv(history_path) if history_path.exists() else pd.DataFrame()
+        return load_snapshot(history_path)
     except Exception:
+        import pandas as pd  # deferred: only needed once there is history to show
         return pd.DataFrame()
 
+@perf.timed("history.save")
 def save_prompt_history(history_path, new_row):
     try:
-        df = load_prompt_history(history_path)
-        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        df.to_csv(history_path, index=False)
+        append_row(history_path, new_row)
         return True
     except Exception as e:
         return False
 
+@perf.timed("build_prompt")
 def build_prompt(goal, tone, output_type, audience, depth, god_mode):
     if "prompt" in goal.lower() and goal.lower().count("prompt") >= 3:
         return f"""
@@ -0,0 +1,367 @@
+import csv
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from utils.constants import history_columns
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+COMPACT_EVERY = 500
+SCAN_CHUNK = 1 << 20
+SNAPSHOT_ENTRIES = int(os.getenv("HISTORY_SNAPSHOT_ENTRIES", 64))
+
+_appends_since_compact = {}
+_compacting = set()
+# Compaction never runs on a save's thread; one background worker is plenty.
+_compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compact")
+# path -> (inode, offset of a known record boundary), so tail checks only scan what is new.
+_record_ends = {}
+_snapshots = OrderedDict()
+_snapshots_lock = threading.Lock()
+
+
+@contextmanager
+def file_lock(path):
+    # Lock a sidecar file so readers/compaction can replace the CSV itself.
+    with open(f"{path}.lock", "a+b") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def encode_rows(rows, header=False):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=history_columns, extrasaction="ignore", lineterminator="\n")
+    if header:
+        writer.writeheader()
+    writer.writerows({col: row.get(col, "") for col in history_columns} for row in rows)
+    return buf.getvalue().encode("utf-8")
+
+
+def _scan_record_end(f, start, stop):
+    # Offset just past the last newline in [start, stop) that is outside a quoted field; start must
+    # be a record boundary. Each chunk is walked back from its last newline, so the Python loop
+    # only visits the few newlines at its end that sit inside a multi-line field.
+    in_quotes = 0
+    end = offset = start
+    f.seek(start)
+    while offset < stop and (chunk := f.read(min(SCAN_CHUNK, stop - offset))):
+        total = chunk.count(b'"') & 1
+        quoted = in_quotes ^ total
+        pos = len(chunk)
+        while (nl := chunk.rfind(b"\n", 0, pos)) >= 0:
+            quoted ^= chunk.count(b'"', nl, pos) & 1
+            if not quoted:
+                end = offset + nl + 1
+                break
+            pos = nl
+        in_quotes ^= total
+        offset += len(chunk)
+    return end
+
+
+def last_record_end(path):
+    # Offset just past the last newline that is outside a quoted field.
+    with open(path, "rb") as f:
+        return _scan_record_end(f, 0, os.fstat(f.fileno()).st_size)
+
+
+def record_end(f, size):
+    # last_record_end for an open file. Prompts span lines, so a file ending in a newline can still
+    # end inside a torn record; the scan starts from the last boundary this process saw in the same
+    # file (an append, scan or compaction), which leaves only the bytes written since. Moves the position.
+    key = os.path.abspath(f.name)
+    inode = os.fstat(f.fileno()).st_ino
+    known = _record_ends.get(key)
+    start = known[1] if known is not None and known[0] == inode and known[1] <= size else 0
+    end = _scan_record_end(f, start, size)
+    _record_ends[key] = (inode, end)
+    return end
+
+
+def repair_tail(path):
+    # A crash mid-append leaves an incomplete record, possibly ending on a newline inside its
+    # quoted prompt; drop it. The caller holds the lock.
+    try:
+        f = open(path, "r+b")
+    except FileNotFoundError:
+        return
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        end = record_end(f, size)
+        if end < size:
+            f.truncate(end)
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def append_rows(path, rows):
+    path = str(path)
+    with file_lock(path):
+        repair_tail(path)
+        before = _signature(path)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            _write_all(fd, encode_rows(rows, header=os.fstat(fd).st_size == 0))
+            os.fsync(fd)
+            stat = os.fstat(fd)
+            _record_ends[os.path.abspath(path)] = (stat.st_ino, stat.st_size)
+        finally:
+            os.close(fd)
+        _extend_snapshot(path, before, rows)
+    _appends_since_compact[path] = _appends_since_compact.get(path, 0) + len(rows)
+    if _appends_since_compact[path] >= COMPACT_EVERY and path not in _compacting:
+        _compacting.add(path)
+        _appends_since_compact[path] = 0
+        _compactor.submit(_compact_in_background, path)
+
+
+def append_row(path, row):
+    append_rows(path, [row])
+
+
+def read_rows(path):
+    # Complete, well-formed records as dicts; the caller holds the lock.
+    with open(path, "rb") as f:
+        end = record_end(f, os.fstat(f.fileno()).st_size)
+        f.seek(0)
+        reader = csv.reader(io.StringIO(f.read(end).decode("utf-8"), newline=""))
+        header = next(reader, None)
+        return [dict(zip(header, rec)) for rec in reader if header and len(rec) == len(header)]
+
+
+def iter_records(path):
+    # Streams complete records as dicts without loading the file. The end is fixed under the lock;
+    # later appends aren't seen, and a compaction replacing the file doesn't disturb the open handle.
+    with file_lock(path):
+        f = open(path, "rb")
+        end = record_end(f, os.fstat(f.fileno()).st_size)
+        f.seek(0)
+
+    def lines():
+        remaining = end
+        for line in f:
+            if remaining <= 0:
+                return
+            line = line[:remaining]
+            remaining -= len(line)
+            yield line.decode("utf-8")
+
+    with f:
+        reader = csv.reader(lines())
+        header = next(reader, None)
+        for rec in reader:
+            if header and len(rec) == len(header):
+                yield dict(zip(header, rec))
+
+
+def write_rows(path, rows):
+    # Atomically replaces the file with a header plus rows; the caller holds the lock.
+    tmp_path = f"{path}.compact"
+    with open(tmp_path, "wb") as f:
+        f.write(encode_rows(rows, header=True))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _parse_records(data, header=None):
+    # (header, well-formed records as dicts); without a header the first record is the header.
+    reader = csv.reader(io.StringIO(data.decode("utf-8"), newline=""))
+    header = header or next(reader, None)
+    return header, [dict(zip(header, rec)) for rec in reader if header and len(rec) == len(header)]
+
+
+def compact(path):
+    # Rewrite the file in timestamp order, dropping torn or malformed records. The parse and sort
+    # run outside the lock on a handle opened under it (the CSV is append-only); the lock is only
+    # taken again to carry over records appended meanwhile and swap the new file in. Returns
+    # False if the file was replaced in between (e.g. by an archive run).
+    path = str(path)
+    with file_lock(path):
+        if not os.path.exists(path):
+            return False
+        f = open(path, "rb")
+        end = record_end(f, os.fstat(f.fileno()).st_size)
+    # Unique, since archive runs use the shared tmp name while holding the lock.
+    tmp_path = f"{path}.compact-{os.getpid()}-{threading.get_ident()}"
+    try:
+        with f:
+            f.seek(0)
+            header, rows = _parse_records(f.read(end))
+            rows.sort(key=lambda row: row.get("timestamp", ""))
+            with open(tmp_path, "wb") as out:
+                out.write(encode_rows(rows, header=True))
+                out.flush()
+                os.fsync(out.fileno())
+            sorted_head = _sorted_snapshot_head(path, len(rows))
+            with file_lock(path):
+                before = _signature(path)
+                if before is None or before[0] != os.fstat(f.fileno()).st_ino:
+                    return False
+                new_end = record_end(f, before[2])
+                f.seek(end)
+                _, extra = _parse_records(f.read(max(0, new_end - end)), header)
+                f.close()
+                with open(tmp_path, "ab") as out:
+                    out.write(encode_rows(extra))
+                    out.flush()
+                    os.fsync(out.fileno())
+                os.replace(tmp_path, path)
+                stat = os.stat(path)
+                _record_ends[os.path.abspath(path)] = (stat.st_ino, stat.st_size)
+                _resort_snapshot(path, before, sorted_head, len(rows), len(extra))
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _compact_in_background(path):
+    try:
+        compact(path)
+    except Exception:
+        pass
+    finally:
+        _compacting.discard(path)
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _remember_snapshot(key, signature, frame, pending=None):
+    # Entries are (signature, frame, rows appended since the frame was parsed).
+    with _snapshots_lock:
+        _snapshots[key] = (signature, frame, pending or [])
+        _snapshots.move_to_end(key)
+        while len(_snapshots) > SNAPSHOT_ENTRIES:
+            _snapshots.popitem(last=False)
+
+
+def _cached_snapshot(key, signature=None):
+    # The cached (signature, frame), with rows appended since it was parsed added in first; None if
+    # nothing is cached (for this signature, when given). Appends only queue their rows, so the
+    # copy that adding them takes is paid here, once per read, not by every save under the lock.
+    with _snapshots_lock:
+        cached = _snapshots.get(key)
+        if cached is None or (signature is not None and cached[0] != signature):
+            return None
+        _snapshots.move_to_end(key)
+        signature, frame, pending = cached[0], cached[1], list(cached[2])
+    if not pending:
+        return signature, frame
+    import pandas as pd
+    try:
+        # Parsed with the snapshot's dtypes so the result matches a full re-read.
+        added = pd.read_csv(io.BytesIO(encode_rows(pending, header=True)), dtype=frame.dtypes.to_dict())
+    except (TypeError, ValueError):
+        # New values don't fit the inferred dtypes (e.g. text in a column that was all empty).
+        with _snapshots_lock:
+            if _snapshots.get(key) is cached:
+                del _snapshots[key]
+        return None
+    frame = pd.concat([frame, added], ignore_index=True)
+    with _snapshots_lock:
+        current = _snapshots.get(key)
+        if current is not None and current[1] is cached[1]:
+            _snapshots[key] = (current[0], frame, current[2][len(pending):])
+    return signature, frame
+
+
+def load_snapshot(path):
+    # Parsed DataFrame of a history CSV, shared by every rerun and session in the process. It is
+    # re-parsed only when the file's (inode, mtime, size) no longer matches; treat it as read-only.
+    import pandas as pd  # deferred: the append/compact paths stay pandas-free
+    key = os.path.abspath(path)
+    signature = _signature(key)
+    if signature is None:
+        return pd.DataFrame()
+    cached = _cached_snapshot(key, signature)
+    if cached is not None:
+        return cached[1]
+    with file_lock(path):
+        # Only complete records: a torn tail left by a crash must not fail the whole parse.
+        with open(key, "rb") as f:
+            signature = _signature(key)
+            end = record_end(f, signature[2])
+            f.seek(0)
+            data = f.read(end)
+    if not data:
+        return pd.DataFrame()
+    frame = pd.read_csv(io.BytesIO(data), on_bad_lines="skip")
+    _remember_snapshot(key, signature, frame)
+    return frame
+
+
+def _sorted_snapshot_head(path, sorted_rows):
+    # A cached snapshot's first sorted_rows rows in compaction order, worked out before the lock
+    # is taken; appends only ever add rows after them.
+    cached = _cached_snapshot(os.path.abspath(path))
+    if cached is None or len(cached[1]) < sorted_rows or list(cached[1].columns) != history_columns:
+        return None
+    return cached[1].iloc[:sorted_rows].sort_values(
+        "timestamp", key=lambda stamps: stamps.fillna("").astype(str), kind="stable"
+    )
+
+
+def _resort_snapshot(path, before, sorted_head, sorted_rows, extra_rows):
+    # Compaction only reorders the file (and drops malformed records), so a snapshot of the
+    # version it replaced is reordered the same way instead of being re-parsed; rows still queued
+    # stay queued. If the row count shows something else changed, it is dropped. The caller holds the lock.
+    import pandas as pd
+    key = os.path.abspath(path)
+    with _snapshots_lock:
+        cached = _snapshots.get(key)
+        if cached is None:
+            return
+        signature, frame, pending = cached
+        if sorted_head is None or signature != before or len(frame) + len(pending) != sorted_rows + extra_rows:
+            _snapshots.pop(key, None)
+            return
+        pending = pending[max(0, sorted_rows - len(frame)):]
+    frame = pd.concat([sorted_head, frame.iloc[sorted_rows:]], ignore_index=True)
+    _remember_snapshot(key, _signature(key), frame, pending)
+
+
+def _extend_snapshot(path, before, rows):
+    # Our own append moves a cached snapshot forward instead of dropping it: the new rows are
+    # queued on it and parsed in on the next read. The caller holds the lock.
+    key = os.path.abspath(path)
+    signature = _signature(key)
+    with _snapshots_lock:
+        cached = _snapshots.get(key)
+        if cached is None:
+            return
+        if cached[0] != before:
+            # Changed behind our back since it was cached; the next load re-parses it.
+            del _snapshots[key]
+            return
+        cached[2].extend({col: row.get(col, "") for col in history_columns} for row in rows)
+        _snapshots[key] = (signature, cached[1], cached[2])
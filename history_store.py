@@ -0,0 +1,427 @@
+import argparse
+import csv
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from pathlib import Path
+
+import numpy as np
+
+from utils import perf
+from utils.archive import archive_path_for, open_archive
+from utils.constants import history_columns
+from utils.helpers import load_prompt_history, save_prompt_history
+from utils.history import append_rows, iter_records
+
+HISTORY_DIR = Path("prompt_histories")
+HISTORY_DB = HISTORY_DIR / "prompt_history.db"
+LEGACY_HISTORY = Path("prompt_history.csv")
+IMPORT_BATCH = 1000
+# Archive rows decoded per step when streaming; a multiple of the archive's text block size.
+STREAM_BATCH = 1024
+SORTABLE_COLUMNS = ("timestamp", "tone", "output_type")
+# Columns held uncompressed in archives; enough to filter and sort without touching prompt texts.
+INDEX_COLUMNS = ["timestamp", "tone", "output_type", "audience"]
+# Users whose archive + tail index a CSV store keeps between calls.
+INDEX_ENTRIES = int(os.getenv("HISTORY_INDEX_ENTRIES", 16))
+
+_stores = {}
+_save_listeners = []
+
+
+def add_save_listener(listener):
+    # listener(user, row) runs after every successful save, e.g. to keep derived indexes current.
+    if listener not in _save_listeners:
+        _save_listeners.append(listener)
+
+
+def notify_saved(user, row):
+    for listener in _save_listeners:
+        try:
+            listener(user, row)
+        except Exception:
+            pass
+
+
+def date_bounds(filters):
+    # (start, end) as timestamp strings, end exclusive; the UI passes inclusive dates.
+    start, end = filters.get("start"), filters.get("end")
+    return (
+        f"{start:%Y-%m-%d}" if start else None,
+        f"{end + timedelta(days=1):%Y-%m-%d}" if end else None,
+    )
+
+
+def filter_frame(df, filters=None, sort=("timestamp", True)):
+    # Applies the same filters/sort as the SQLite store to a loaded history frame; "id" is the row position.
+    if "id" not in df:
+        df = df.assign(id=range(len(df)))
+    if df.empty:
+        return df
+    filters = filters or {}
+    for col in ("tone", "output_type"):
+        if filters.get(col):
+            df = df[df[col].isin(filters[col])]
+    start, end = date_bounds(filters)
+    if start:
+        df = df[df["timestamp"].astype(str) >= start]
+    if end:
+        df = df[df["timestamp"].astype(str) < end]
+    column, descending = sort
+    return df.sort_values([column, "id"], ascending=not descending, kind="stable")
+
+
+def row_matches(row, filters, start=None, end=None):
+    # The tone/format/date filters applied to one row dict; start/end come from date_bounds.
+    for col in ("tone", "output_type"):
+        if filters.get(col) and row.get(col) not in filters[col]:
+            return False
+    stamp = str(row.get("timestamp") or "")
+    return (not start or stamp >= start) and (not end or stamp < end)
+
+
+def preview(df, preview_chars):
+    if preview_chars and "prompt" in df:
+        long = df["prompt"].astype(str).str.len() > preview_chars
+        df = df.assign(prompt=df["prompt"].astype(str).str.slice(0, preview_chars).where(~long, lambda s: s + "…"))
+    return df
+
+
+class CSVHistoryStore:
+    def __init__(self, history_dir=HISTORY_DIR, filename="{user}_prompt_history.csv"):
+        self.history_dir = Path(history_dir)
+        self.history_dir.mkdir(exist_ok=True)
+        self.filename = filename
+        self._indexes = OrderedDict()
+        self._indexes_lock = threading.Lock()
+
+    def path_for(self, user):
+        return self.history_dir / self.filename.format(user=user)
+
+    def save(self, user, row):
+        saved = save_prompt_history(self.path_for(user), row)
+        if saved:
+            notify_saved(user, row)
+        return saved
+
+    @perf.timed("history.save_many")
+    def save_many(self, user, rows):
+        # One locked append (and one fsync) for the whole batch.
+        try:
+            append_rows(self.path_for(user), rows)
+        except Exception:
+            return False
+        for row in rows:
+            notify_saved(user, row)
+        return True
+
+    def users(self):
+        # Users with a history file or archive; a fixed filename (the legacy single file) has none.
+        if "{user}" not in self.filename:
+            return []
+        pattern = Path(self.filename.format(user="*"))
+        paths = set(self.history_dir.glob(pattern.name))
+        paths |= {p.with_suffix(pattern.suffix) for p in self.history_dir.glob(archive_path_for(pattern).name)}
+        prefix, suffix = self.filename.split("{user}")
+        return sorted(p.name[len(prefix):len(p.name) - len(suffix)] for p in paths)
+
+    def _parts(self, user):
+        # (archive or None, hot CSV tail); tail rows the archive already covers are dropped.
+        return self._cached(user)[:2]
+
+    def _index(self, user):
+        # (archive, tail, light columns for archive + tail with ids, archive rows first); texts are
+        # fetched per page.
+        return self._cached(user, index=True)
+
+    def _cached(self, user, index=False):
+        # _parts and _index are worked out once per version of the user's files: the tail snapshot
+        # and the archive mapping are both reused until their file changes, so a rerun that calls
+        # count and page finds them here instead of rebuilding the index each time.
+        import pandas as pd
+        path = self.path_for(user)
+        snapshot = load_prompt_history(path)
+        archive = open_archive(archive_path_for(path))
+        with self._indexes_lock:
+            entry = self._indexes.get(user)
+        if entry is None or entry["snapshot"] is not snapshot or entry["archive"] is not archive:
+            tail = snapshot
+            if archive is not None and not tail.empty:
+                tail = tail[tail["timestamp"].astype(str) >= archive.cutoff].reset_index(drop=True)
+            entry = {"snapshot": snapshot, "archive": archive, "tail": tail, "index": None}
+        with self._indexes_lock:
+            self._indexes[user] = entry
+            self._indexes.move_to_end(user)
+            while len(self._indexes) > INDEX_ENTRIES:
+                self._indexes.popitem(last=False)
+        tail = entry["tail"]
+        if not index:
+            return archive, tail
+        if entry["index"] is None:
+            if archive is None:
+                entry["index"] = tail
+            else:
+                frame = pd.concat([archive.frame(INDEX_COLUMNS), tail.reindex(columns=INDEX_COLUMNS)], ignore_index=True)
+                entry["index"] = frame.assign(id=range(len(frame)))
+        return archive, tail, entry["index"]
+
+    def load(self, user):
+        import pandas as pd
+        archive, tail = self._parts(user)
+        if archive is None:
+            return tail
+        return pd.concat([archive.frame(), tail], ignore_index=True)
+
+    @perf.timed("history.count")
+    def count(self, user, filters=None):
+        if filters and any(filters.values()):
+            _, _, index = self._index(user)
+            return len(filter_frame(index, filters))
+        archive, tail = self._parts(user)
+        return len(tail) + (len(archive) if archive is not None else 0)
+
+    @perf.timed("history.page")
+    def page(self, user, offset, limit, filters=None, sort=("timestamp", True), preview_chars=None):
+        archive, tail, index = self._index(user)
+        rows = filter_frame(index, filters, sort)
+        rows = rows.iloc[offset:] if limit < 0 else rows.iloc[offset:offset + limit]
+        if archive is not None and len(rows):
+            # Only the archive blocks holding this page's rows are decompressed.
+            ids = rows["id"].to_numpy()
+            archived = ids < len(archive)
+            for col in ("goal", "prompt"):
+                texts = np.empty(len(ids), dtype=object)
+                texts[archived] = archive.column(col, ids[archived])
+                texts[~archived] = tail[col].to_numpy()[ids[~archived] - len(archive)] if col in tail else ""
+                rows = rows.assign(**{col: texts})
+            rows = rows[["id"] + history_columns]
+        return preview(rows, preview_chars).reset_index(drop=True)
+
+    def iter_rows(self, user, filters=None):
+        # Streams matching rows as dicts, oldest first: the archive a batch of rows at a time, then
+        # the CSV tail as it is read. Memory stays flat however long the history is.
+        filters = filters or {}
+        start, end = date_bounds(filters)
+        path = self.path_for(user)
+        archive = open_archive(archive_path_for(path))
+        if archive is not None:
+            first, last = archive.span(start, end)
+            for offset in range(first, last, STREAM_BATCH):
+                positions = np.arange(offset, min(offset + STREAM_BATCH, last))
+                for col in ("tone", "output_type"):
+                    if filters.get(col):
+                        positions = positions[np.isin(archive.column(col, positions), filters[col])]
+                yield from archive.records(positions)
+        if path.exists():
+            floor = max(start or "", archive.cutoff if archive is not None else "")
+            for row in iter_records(path):
+                if row_matches(row, filters, floor, end):
+                    yield row
+
+    def get(self, user, row_id):
+        archive, tail = self._parts(user)
+        if archive is not None:
+            if 0 <= row_id < len(archive):
+                return archive.frame(positions=[row_id]).iloc[0].to_dict()
+            row_id -= len(archive)
+        return tail.iloc[row_id].to_dict() if 0 <= row_id < len(tail) else None
+
+
+class SQLiteHistoryStore:
+    def __init__(self, db_path=HISTORY_DB):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS prompt_history (
+                    id INTEGER PRIMARY KEY,
+                    user TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    goal TEXT,
+                    tone TEXT,
+                    output_type TEXT,
+                    audience TEXT,
+                    prompt TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_history_user_ts ON prompt_history (user, timestamp);
+                CREATE INDEX IF NOT EXISTS idx_history_ts ON prompt_history (timestamp);
+                CREATE INDEX IF NOT EXISTS idx_history_user_tone ON prompt_history (user, tone, timestamp);
+                CREATE INDEX IF NOT EXISTS idx_history_user_output_type ON prompt_history (user, output_type, timestamp);
+                CREATE TABLE IF NOT EXISTS imported_files (
+                    path TEXT PRIMARY KEY,
+                    rows INTEGER NOT NULL
+                );
+            """)
+
+    def _conn(self):
+        # sqlite3 connections are per-thread; Streamlit runs each session on its own thread.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _insert(self, conn, user, rows):
+        # user=None takes each row's own "user" value.
+        conn.executemany(
+            f"INSERT INTO prompt_history (user, {', '.join(history_columns)}) "
+            f"VALUES (?{', ?' * len(history_columns)})",
+            ([row["user"] if user is None else user] + [row.get(col) or "" for col in history_columns] for row in rows),
+        )
+
+    def insert_rows(self, rows):
+        # Bulk load of rows that carry their own "user"; save listeners are not notified.
+        with self._conn() as conn:
+            self._insert(conn, None, rows)
+
+    @perf.timed("history.save")
+    def save(self, user, row):
+        try:
+            with self._conn() as conn:
+                self._insert(conn, user, [row])
+        except sqlite3.Error:
+            return False
+        notify_saved(user, row)
+        return True
+
+    @perf.timed("history.save_many")
+    def save_many(self, user, rows):
+        # One transaction for the whole batch.
+        try:
+            with self._conn() as conn:
+                self._insert(conn, user, rows)
+        except sqlite3.Error:
+            return False
+        for row in rows:
+            notify_saved(user, row)
+        return True
+
+    def users(self):
+        return [row[0] for row in self._conn().execute("SELECT DISTINCT user FROM prompt_history ORDER BY user")]
+
+    def load(self, user):
+        return self.page(user, 0, -1).drop(columns="id")
+
+    def _where(self, user, filters):
+        clauses, params = ["user = ?"], [user]
+        filters = filters or {}
+        for col in ("tone", "output_type"):
+            if filters.get(col):
+                clauses.append(f"{col} IN ({', '.join('?' * len(filters[col]))})")
+                params += list(filters[col])
+        start, end = date_bounds(filters)
+        if start:
+            clauses.append("timestamp >= ?")
+            params.append(start)
+        if end:
+            clauses.append("timestamp < ?")
+            params.append(end)
+        return " AND ".join(clauses), params
+
+    def iter_rows(self, user, filters=None):
+        # Streams matching rows as dicts, oldest first, IMPORT_BATCH rows per fetch. The connection
+        # is the consuming thread's own, so the generator can be drained from a download thread.
+        where, params = self._where(user, filters)
+        cursor = self._conn().execute(
+            f"SELECT {', '.join(history_columns)} FROM prompt_history WHERE {where} ORDER BY timestamp, id", params
+        )
+        while batch := cursor.fetchmany(IMPORT_BATCH):
+            for values in batch:
+                yield {col: "" if value is None else value for col, value in zip(history_columns, values)}
+
+    @perf.timed("history.count")
+    def count(self, user, filters=None):
+        where, params = self._where(user, filters)
+        return self._conn().execute(f"SELECT COUNT(*) FROM prompt_history WHERE {where}", params).fetchone()[0]
+
+    @perf.timed("history.page")
+    def page(self, user, offset, limit, filters=None, sort=("timestamp", True), preview_chars=None):
+        import pandas as pd
+        column, descending = sort
+        if column not in SORTABLE_COLUMNS:
+            raise ValueError(f"cannot sort history by {column!r}")
+        direction = "DESC" if descending else "ASC"
+        columns = [
+            f"CASE WHEN length(prompt) > {int(preview_chars)} THEN substr(prompt, 1, {int(preview_chars)}) || '…' "
+            "ELSE prompt END AS prompt" if col == "prompt" and preview_chars else col
+            for col in history_columns
+        ]
+        where, params = self._where(user, filters)
+        return pd.read_sql_query(
+            f"SELECT id, {', '.join(columns)} FROM prompt_history WHERE {where} "
+            f"ORDER BY {column} {direction}, id {direction} LIMIT ? OFFSET ?",
+            self._conn(), params=params + [limit, offset],
+        )
+
+    def get(self, user, row_id):
+        cursor = self._conn().execute(
+            f"SELECT {', '.join(history_columns)} FROM prompt_history WHERE user = ? AND id = ?", (user, row_id)
+        )
+        row = cursor.fetchone()
+        return dict(zip(history_columns, row)) if row else None
+
+    def import_csv(self, path, user):
+        # One-time: a file already recorded in imported_files is skipped.
+        path = Path(path)
+        key = str(path.resolve())
+        conn = self._conn()
+        if not path.exists() or conn.execute("SELECT 1 FROM imported_files WHERE path = ?", (key,)).fetchone():
+            return 0
+        total = 0
+        archive = open_archive(archive_path_for(path))
+        with conn, open(path, "r", encoding="utf-8", newline="") as f:
+            if archive is not None:
+                self._insert(conn, user, archive.records())
+                total += len(archive)
+            batch = []
+            for row in csv.DictReader(f):
+                if archive is not None and row.get("timestamp", "") < archive.cutoff:
+                    continue
+                batch.append(row)
+                if len(batch) >= IMPORT_BATCH:
+                    self._insert(conn, user, batch)
+                    total += len(batch)
+                    batch = []
+            self._insert(conn, user, batch)
+            total += len(batch)
+            conn.execute("INSERT INTO imported_files (path, rows) VALUES (?, ?)", (key, total))
+        return total
+
+
+def import_csv_histories(store, history_dir=HISTORY_DIR, legacy_path=LEGACY_HISTORY, legacy_user="demo"):
+    imported = {}
+    for path in sorted(Path(history_dir).glob("*_prompt_history.csv")):
+        user = path.name[:-len("_prompt_history.csv")]
+        imported[user] = imported.get(user, 0) + store.import_csv(path, user)
+    imported[legacy_user] = imported.get(legacy_user, 0) + store.import_csv(legacy_path, legacy_user)
+    return imported
+
+
+def get_history_store():
+    # One store per process; HISTORY_BACKEND selects "csv" (default) or "sqlite".
+    backend = os.getenv("HISTORY_BACKEND", "csv").lower()
+    if backend not in _stores:
+        if backend == "sqlite":
+            store = SQLiteHistoryStore(os.getenv("HISTORY_DB", HISTORY_DB))
+            import_csv_histories(store)
+            _stores[backend] = store
+        else:
+            _stores[backend] = CSVHistoryStore()
+    return _stores[backend]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import CSV prompt histories into the SQLite store.")
+    parser.add_argument("--db", default=os.getenv("HISTORY_DB", HISTORY_DB))
+    parser.add_argument("--history-dir", default=HISTORY_DIR)
+    parser.add_argument("--legacy-csv", default=LEGACY_HISTORY)
+    parser.add_argument("--legacy-user", default="demo")
+    args = parser.parse_args()
+    counts = import_csv_histories(SQLiteHistoryStore(args.db), args.history_dir, args.legacy_csv, args.legacy_user)
+    for user, rows in counts.items():
+        print(f"{user}: {rows} rows imported")
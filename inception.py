@@ -0,0 +1,130 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import perf
+from utils.generation import run_concurrently
+from utils.helpers import build_prompt
+from utils.response_cache import cached_generate
+from utils.similarity import jaccard, normalize_goal, shingles
+
+# Prompt inception: stage 1 is the usual build_prompt request, and every further depth level
+# sends the previous stage's prompt back to the model for another refinement pass. Each stage
+# goes through cached_generate keyed by its own input (stage 1 by the form fields at depth 1,
+# later stages by the prompt they refine), so depth 4 after depth 3 only pays for stage 4.
+# God mode runs one branch per focus at every stage, in parallel, and keeps the best one.
+# The pipeline stops early once a pass barely changes the prompt.
+CONVERGENCE_THRESHOLD = float(os.getenv("INCEPTION_CONVERGENCE", 0.9))
+BRANCH_WORKERS = int(os.getenv("INCEPTION_BRANCH_WORKERS", 16))
+REFINE_FOCUS = "clarity, structure and anything the prompt leaves ambiguous"
+GOD_MODE_FOCUSES = (
+    "clarity and structure",
+    "specific, concrete constraints and success criteria",
+    "examples of good output and edge cases to handle",
+)
+
+# God-mode branches get their own pool: the pipeline itself often runs on the generation pool
+# (remix, matrix, batch), and queueing its branches behind it there can deadlock.
+_branch_executor = ThreadPoolExecutor(max_workers=BRANCH_WORKERS, thread_name_prefix="inception")
+
+REFINE_TEMPLATE = """
+You are an AI prompt engineer running another pass of prompt inception.
+Rewrite the prompt below into a stronger version, focusing on {focus}.
+Keep its goal, tone, format and audience. If it is already as good as it can be, return it unchanged.
+Respond only with the improved prompt and its customization tip.
+
+Prompt:
+{prompt}
+"""
+
+
+def score_prompt(text, params):
+    # Cheap stand-in for a judge call: rewards covering the goal's words and the requested
+    # tone/format/audience, and visible structure; very short or rambling outputs lose points.
+    if not text:
+        return 0.0
+    lowered = text.casefold()
+    words = {word for word in normalize_goal(params.get("goal")).split() if len(word) > 3}
+    coverage = sum(word in lowered for word in words) / len(words) if words else 1.0
+    asks = [str(params[key]).casefold() for key in ("tone", "output_type", "audience") if params.get(key)]
+    asked = sum(ask in lowered for ask in asks) / len(asks) if asks else 1.0
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    structured = sum(line[0] in "-*#•" or line.split(".", 1)[0].isdigit() for line in lines)
+    length = min(1.0, len(text) / 400) * min(1.0, 6000 / len(text))
+    return 2 * coverage + asked + min(1.0, structured / 5) + length
+
+
+def similarity(a, b):
+    x, y = shingles(a), shingles(b)
+    return jaccard(x, y) if x.size and y.size else float(a == b)
+
+
+def _requests(level, base, previous, focuses):
+    # (prompt text, cache key params) per branch of one stage.
+    if level == 1:
+        prompt_text = build_prompt(**base)
+        return [(prompt_text + (f"\nPay particular attention to {focus}.\n" if focus else ""), base) for focus in focuses]
+    return [(REFINE_TEMPLATE.format(focus=focus or REFINE_FOCUS, prompt=previous), {"stage": "refine"})
+            for focus in focuses]
+
+
+@perf.timed("inception")
+def run_inception(model, params, bypass=False, on_chunk=None, on_stage=None, on_queue=None, timings=None):
+    # Returns (text, from_cache, stages). Each stage is {"level", "text", "from_cache", "similarity",
+    # "scores", "converged"}; on_stage(stage) runs as each level finishes. Single-branch stages stream
+    # through on_chunk; god-mode branches run side by side and only report the winner.
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    base = dict(params, depth=1, god_mode=False)
+    depth = max(1, int(params.get("depth") or 1))
+    focuses = GOD_MODE_FOCUSES if params.get("god_mode") else (None,)
+
+    def stream(chunk):
+        timings.setdefault("first_token_ms", (time.perf_counter() - start) * 1000)
+        if on_chunk:
+            on_chunk(chunk)
+
+    stages = []
+    text = ""
+    for level in range(1, depth + 1):
+        requests = _requests(level, base, text, focuses)
+        if len(requests) == 1:
+            prompt_text, key_params = requests[0]
+            candidates = [cached_generate(model, prompt_text, bypass=bypass, on_chunk=stream, on_queue=on_queue,
+                                          **key_params)]
+        else:
+            def branch(request):
+                return cached_generate(model, request[0], bypass=bypass, **request[1])
+
+            candidates, errors = [], []
+            for _, outcome, error in run_concurrently(branch, requests, len(requests), _branch_executor):
+                if error:
+                    errors.append(error)
+                else:
+                    candidates.append(outcome)
+            if not candidates:
+                raise errors[0]
+        scores = [score_prompt(candidate, params) for candidate, _ in candidates]
+        best, from_cache = candidates[scores.index(max(scores))]
+        if not best:
+            if not stages:
+                break
+            # An empty refinement keeps the previous stage's prompt.
+            stages[-1]["converged"] = True
+            break
+        stage = {
+            "level": level, "text": best, "from_cache": from_cache,
+            "similarity": similarity(text, best) if text else None,
+            "scores": scores if len(scores) > 1 else None, "converged": False,
+        }
+        stage["converged"] = stage["similarity"] is not None and stage["similarity"] >= CONVERGENCE_THRESHOLD
+        stages.append(stage)
+        text = best
+        if on_stage:
+            on_stage(stage)
+        if stage["converged"]:
+            break
+
+    timings["total_ms"] = (time.perf_counter() - start) * 1000
+    timings.setdefault("first_token_ms", timings["total_ms"])
+    return text, bool(stages) and all(stage["from_cache"] for stage in stages), stages
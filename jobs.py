@@ -0,0 +1,103 @@
+import itertools
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.singleflight import Flight
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 16))
+# Finished jobs nobody has collected are dropped after this long.
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", 3600))
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+class Job(Flight):
+    # A Flight with an id: the worker publishes chunks and status, any rerun can look at its progress.
+    def __init__(self, job_id, kind):
+        super().__init__()
+        self.id = job_id
+        self.kind = kind
+        self.created = time.time()
+        self.finished = None
+        self.info = {}
+
+    def finish(self, result=None, error=None):
+        self.finished = time.time()
+        super().finish(result, error)
+
+    def update(self, **info):
+        # Extra progress the worker wants to surface, e.g. finished inception stages.
+        with self.cond:
+            self.info = dict(self.info, **info)
+            self.cond.notify_all()
+
+    def progress(self):
+        # (chunks so far, status, done) without blocking.
+        with self.cond:
+            return list(self.chunks), self.status, self.done
+
+
+class JobQueue:
+    # Work submitted from a script run lives here rather than in the run, so a rerun (any widget
+    # click) only stops rendering it; the next run looks the job up again by id.
+    def __init__(self, workers=JOB_WORKERS, retention=JOB_RETENTION_SECONDS):
+        self.retention = retention
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "expired": 0}
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+
+    def submit(self, kind, fn, *args, **kwargs):
+        # fn(job, *args, **kwargs) runs on the pool; its return value becomes job.result.
+        job = Job(f"{kind}-{next(self._counter)}-{uuid.uuid4().hex[:8]}", kind)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+            self.stats["submitted"] += 1
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def _run(self, job, fn, args, kwargs):
+        try:
+            job.finish(result=fn(job, *args, **kwargs))
+            outcome = "completed"
+        except Exception as e:
+            job.finish(error=e)
+            outcome = "failed"
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+            self.stats["expired"] += 1
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def consume(self, job_id):
+        # Hands a finished job over to the caller and forgets it; running jobs stay put.
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.done:
+                del self._jobs[job_id]
+            return job
+
+    def pending(self):
+        with self._lock:
+            return sum(not job.done for job in self._jobs.values())
+
+
+def get_job_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
@@ -0,0 +1,189 @@
+import argparse
+import os
+import pickle
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Drives app.py headlessly with Streamlit's AppTest: N concurrent sessions each log in, pick a
+# template, submit with save on, wait for the background job, remix, and repeat. Everything
+# runs against the offline fake model, so the numbers can gate regressions in CI.
+# AppTest swaps process globals on every run, so script runs are serialized through one lock;
+# model calls, background jobs and history writes still overlap across sessions. Rerun latency
+# is the script's own time, and time spent waiting for the runner is reported separately.
+#   python -m utils.loadtest --sessions 8 --iterations 5 --latency 0.2 --max-p95-ms 500
+APP_PATH = Path(__file__).parent / "app.py"
+POLL_INTERVAL = 0.1
+STEP_TIMEOUT = 60.0
+QUANTILES = (0.5, 0.95, 0.99)
+
+_runner_lock = threading.Lock()
+
+
+def _quantile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def _state_bytes(state):
+    total = 0
+    for value in state.values():
+        try:
+            total += len(pickle.dumps(value))
+        except Exception:
+            total += sys.getsizeof(value)
+    return total
+
+
+class Session:
+    def __init__(self, index, iterations, seed, results):
+        from streamlit.testing.v1 import AppTest
+        self.index = index
+        self.iterations = iterations
+        self.rng = random.Random(seed + index)
+        self.results = results
+        self.at = AppTest.from_file(str(APP_PATH), default_timeout=STEP_TIMEOUT)
+        self.state_bytes = []
+
+    def rerun(self, step):
+        queued = time.perf_counter()
+        with _runner_lock:
+            started = time.perf_counter()
+            self.at.run()
+            elapsed = (time.perf_counter() - started) * 1000
+        with self.results["lock"]:
+            self.results["reruns"].append((step, elapsed))
+            self.results["runner_wait"].append((started - queued) * 1000)
+            self.results["exceptions"] += len(self.at.exception)
+            self.results["save_failures"] += sum("Failed to save history" in e.value for e in self.at.error)
+
+    def click(self, label, step):
+        for button in self.at.button:
+            if label in str(button.label):
+                button.click()
+                self.rerun(step)
+                return True
+        return False
+
+    def wait_for(self, key, done_keys, step):
+        deadline = time.monotonic() + STEP_TIMEOUT
+        while time.monotonic() < deadline:
+            current = self.at.session_state[key] if key in self.at.session_state else None
+            if current is None or any(k in current for k in done_keys):
+                return
+            time.sleep(POLL_INTERVAL)
+            self.rerun(step)
+        raise TimeoutError(f"session {self.index}: {key} did not finish within {STEP_TIMEOUT:.0f} s")
+
+    def run(self):
+        self.rerun("login form")
+        self.at.text_input[0].input("demo")
+        self.at.text_input[1].input("pass123")
+        self.click("Login", "login")
+        self.rerun("first page")
+        for iteration in range(self.iterations):
+            templates = [b for b in self.at.button if (b.key or "").startswith("btn_")]
+            if templates:
+                self.rng.choice(templates).click()
+                self.rerun("template")
+            self.at.text_area[0].input(f"Load test goal from session {self.index}, round {iteration}: {self.rng.random()}")
+            next(c for c in self.at.checkbox if "Save this" in str(c.label)).check()
+            self.click("Generate Prompt", "submit")
+            self.click("Generate anyway", "near-duplicate")
+            self.wait_for("generation", ("result", "error"), "poll generation")
+            if "error" not in self.at.session_state["generation"]:
+                with self.results["lock"]:
+                    self.results["saves"] += 1
+            if self.click("Remix This Prompt", "remix"):
+                self.wait_for("remix", ("outcomes",), "poll remix")
+            self.state_bytes.append(_state_bytes(self.at.session_state))
+            with self.results["lock"]:
+                self.results["flows"] += 1
+
+
+def run_load(sessions, iterations, latency, seed=0):
+    # Runs in a scratch directory so prompt_histories/ and caches start empty.
+    workdir = Path(tempfile.mkdtemp(prefix="loadtest-"))
+    (workdir / ".streamlit").mkdir()
+    (workdir / ".streamlit" / "secrets.toml").write_text('GOOGLE_API_KEY = "offline"\n')
+    os.chdir(workdir)
+    os.environ["MODEL_BACKENDS"] = f"fake:{latency}"
+
+    from utils.history import read_rows
+    from utils.history_store import get_history_store
+
+    results = {"lock": threading.Lock(), "reruns": [], "runner_wait": [], "exceptions": 0, "save_failures": 0,
+               "saves": 0, "flows": 0, "failures": []}
+    drivers = [Session(i, iterations, seed, results) for i in range(sessions)]
+
+    def drive(driver):
+        try:
+            driver.run()
+        except Exception as e:
+            with results["lock"]:
+                results["failures"].append(f"session {driver.index}: {e!r}")
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=drive, args=(d,), name=f"loadtest-{d.index}") for d in drivers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results["seconds"] = time.perf_counter() - started
+
+    store = get_history_store()
+    history_path = getattr(store, "path_for", lambda user: None)("demo")
+    if history_path is not None and history_path.exists():
+        results["saved_rows"] = len(read_rows(history_path))
+    else:
+        results["saved_rows"] = store.count("demo")
+    results["state_bytes"] = [d.state_bytes for d in drivers if d.state_bytes]
+    results["workdir"] = workdir
+    return results
+
+
+def report(results, max_p95_ms=None):
+    # Prints the summary; returns the process exit code (1 when a gate fails).
+    by_step = {}
+    for step, ms in results["reruns"]:
+        by_step.setdefault(step, []).append(ms)
+    ordered = sorted(ms for _, ms in results["reruns"])
+    lines = [f"{results['flows']} flows · {len(ordered)} reruns in {results['seconds']:.1f} s · "
+             f"{results['flows'] / results['seconds']:.2f} flows/s · {len(ordered) / results['seconds']:.1f} reruns/s"]
+    lines.append(f"{'step':<18}{'n':>6}" + "".join(f"{f'p{round(q * 100)} ms':>10}" for q in QUANTILES))
+    for step, values in [("all", ordered)] + sorted(by_step.items()):
+        values = sorted(values)
+        lines.append(f"{step:<18}{len(values):>6}" + "".join(f"{_quantile(values, q):>10.1f}" for q in QUANTILES))
+    waits = sorted(results["runner_wait"])
+    lines.append(f"{'(runner wait)':<18}{len(waits):>6}" + "".join(f"{_quantile(waits, q):>10.1f}" for q in QUANTILES))
+    if results["state_bytes"]:
+        first = sum(s[0] for s in results["state_bytes"]) / len(results["state_bytes"])
+        last = sum(s[-1] for s in results["state_bytes"]) / len(results["state_bytes"])
+        rounds = max(len(s) for s in results["state_bytes"])
+        lines.append(f"session_state: {first / 1024:.1f} KiB after round 1 -> {last / 1024:.1f} KiB after round {rounds} "
+                     f"({(last - first) / max(1, rounds - 1) / 1024:+.1f} KiB/round per session)")
+    lost = results["saves"] - results["saved_rows"]
+    lines.append(f"history: {results['saves']} saves · {results['saved_rows']} rows on disk · {lost} lost · "
+                 f"{results['save_failures']} save errors · {results['exceptions']} exceptions")
+    lines += results["failures"]
+    print("\n".join(lines))
+
+    failed = bool(results["failures"] or results["exceptions"] or results["save_failures"] or lost)
+    p95 = _quantile(ordered, 0.95)
+    if max_p95_ms is not None and p95 > max_p95_ms:
+        print(f"FAIL: rerun p95 {p95:.1f} ms exceeds {max_p95_ms:.1f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline multi-session load test for app.py.")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=3, help="submit/remix rounds per session")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model latency in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-p95-ms", type=float, default=None, help="fail if rerun p95 exceeds this")
+    args = parser.parse_args()
+    sys.exit(report(run_load(args.sessions, args.iterations, args.latency, args.seed), args.max_p95_ms))
@@ -0,0 +1,203 @@
+import itertools
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils import perf
+
+DEFAULT_MODEL = "models/gemini-1.5-flash"
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", 0.95))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", 0.25))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", 3.0))
+HEDGE_MIN_SAMPLES = 20
+FAILURE_COOLDOWN = 30.0
+
+_hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="backend")
+
+
+class FakeThrottleError(RuntimeError):
+    code = 429
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    # Offline stand-in for genai.GenerativeModel with injectable latency and failures.
+    def __init__(self, model_name="fake", latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, seed=None):
+        self.model_name = model_name
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self._rng = random.Random(seed)
+
+    def _respond(self, prompt):
+        if self._rng.random() < self.throttle_rate:
+            raise FakeThrottleError(f"{self.model_name}: 429 resource exhausted")
+        time.sleep(max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter)))
+        if self._rng.random() < self.error_rate:
+            raise RuntimeError(f"{self.model_name}: injected failure")
+        text = prompt if isinstance(prompt, str) else " ".join(p for p in prompt if isinstance(p, str))
+        return f"[{self.model_name}] {' '.join(text.split())[:400]}"
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        text = self._respond(prompt)
+        if not stream:
+            return FakeResponse(text)
+        words = text.split(" ")
+        return iter([FakeResponse(word + " ") for word in words])
+
+
+class LatencyHistogram:
+    # Log-spaced buckets from 10 ms to ~2 min; counts are halved past max_count so old samples fade.
+    bounds = [0.01 * 1.25 ** k for k in range(43)]
+
+    def __init__(self, max_count=1000):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.max_count = max_count
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        index = next((i for i, bound in enumerate(self.bounds) if seconds <= bound), len(self.bounds))
+        with self._lock:
+            self.counts[index] += 1
+            self.total += 1
+            if self.total > self.max_count:
+                self.counts = [count // 2 for count in self.counts]
+                self.total = sum(self.counts)
+
+    def quantile(self, q):
+        with self._lock:
+            target = q * self.total
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if count and seen >= target:
+                    return self.bounds[min(index, len(self.bounds) - 1)]
+        return None
+
+
+class HedgedModel:
+    # Calls backends in priority order. If the current attempt is slower than that backend's
+    # HEDGE_QUANTILE latency, the next backend is fired too and the first answer wins; an error
+    # fails over to the next backend immediately. Losing calls cannot be interrupted once
+    # started, so their results are discarded (queued ones are cancelled).
+    def __init__(self, backends, hedge_quantile=HEDGE_QUANTILE, min_delay=HEDGE_MIN_DELAY,
+                 default_delay=HEDGE_DEFAULT_DELAY):
+        self.backends = list(backends)
+        self.model_name = "+".join(getattr(b, "model_name", "?") for b in self.backends)
+        self.hedge_quantile = hedge_quantile
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.histograms = [LatencyHistogram() for _ in self.backends]
+        self.stats = {"calls": 0, "hedges": 0, "failovers": 0, "errors": 0,
+                      "wins": [0] * len(self.backends)}
+        self._down_until = [0.0] * len(self.backends)
+        self._lock = threading.Lock()
+
+    def hedge_delay(self, index):
+        histogram = self.histograms[index]
+        if histogram.total < HEDGE_MIN_SAMPLES:
+            return self.default_delay
+        return max(self.min_delay, histogram.quantile(self.hedge_quantile))
+
+    def _order(self):
+        now = time.monotonic()
+        healthy = [i for i in range(len(self.backends)) if self._down_until[i] <= now]
+        return healthy + [i for i in range(len(self.backends)) if i not in healthy]
+
+    def _call(self, index, prompt, stream, kwargs):
+        start = time.perf_counter()
+        try:
+            if stream:
+                # Race on the first chunk; the winner's iterator keeps streaming.
+                chunks = iter(self.backends[index].generate_content(prompt, stream=True, **kwargs))
+                first = next(chunks, None)
+                result = iter(()) if first is None else itertools.chain([first], chunks)
+            else:
+                result = self.backends[index].generate_content(prompt, **kwargs)
+        except Exception:
+            with self._lock:
+                self.stats["errors"] += 1
+                self._down_until[index] = time.monotonic() + FAILURE_COOLDOWN
+            raise
+        self.histograms[index].record(time.perf_counter() - start)
+        self._down_until[index] = 0.0
+        return result
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        order = self._order()
+        pending = {}
+        errors = []
+
+        def launch():
+            index = order[len(pending) + len(errors)]
+            pending[_hedge_executor.submit(self._call, index, prompt, stream, kwargs)] = index
+
+        with self._lock:
+            self.stats["calls"] += 1
+        launch()
+        while pending:
+            can_launch = len(pending) + len(errors) < len(order)
+            newest = order[len(pending) + len(errors) - 1]
+            done, _ = wait(pending, timeout=self.hedge_delay(newest) if can_launch else None,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                with self._lock:
+                    self.stats["hedges"] += 1
+                launch()
+                continue
+            failed = 0
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    failed += 1
+                    continue
+                for loser in pending:
+                    loser.cancel()
+                with self._lock:
+                    self.stats["wins"][index] += 1
+                return result
+            if failed and len(pending) + len(errors) < len(order):
+                with self._lock:
+                    self.stats["failovers"] += 1
+                launch()
+        raise errors[-1]
+
+
+def create_backend(name, api_key=None):
+    # "fake[:latency[:error_rate[:throttle_rate]]]" gives an offline model; anything else is a Gemini model name.
+    if name.split(":")[0] == "fake":
+        _, latency, error_rate, throttle_rate = (name.split(":") + ["", "", ""])[:4]
+        return FakeModel(
+            model_name=name,
+            latency=float(latency or os.getenv("FAKE_MODEL_LATENCY", 0.0)),
+            error_rate=float(error_rate or 0.0),
+            throttle_rate=float(throttle_rate or 0.0),
+        )
+    import google.generativeai as genai
+    api_key = api_key or os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise RuntimeError("GOOGLE_API_KEY not found.")
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(name)
+
+
+@perf.timed("model.configure")
+def create_model(name=None, api_key=None):
+    # A comma-separated list (argument or MODEL_BACKENDS) builds a hedged, failing-over model.
+    # Either way calls go through the shared rate limiter unless MODEL_RATE_LIMIT is 0.
+    from utils.ratelimit import ThrottledModel, RATE_PER_SECOND
+    names = [n.strip() for n in (name or os.getenv("MODEL_BACKENDS") or DEFAULT_MODEL).split(",") if n.strip()]
+    backends = [create_backend(n, api_key) for n in names]
+    model = backends[0] if len(backends) == 1 else HedgedModel(backends)
+    return ThrottledModel(model) if RATE_PER_SECOND > 0 else model
@@ -0,0 +1,64 @@
+from datetime import date, timedelta
+
+import streamlit as st
+from dotenv import load_dotenv
+
+# Before the utils imports, which read their settings at import time; this page can be opened directly.
+load_dotenv()
+
+from utils import auth
+from utils.analytics import ALL_USERS, get_analytics
+
+st.set_page_config(page_title="Usage Dashboard", page_icon="📊", layout="wide")
+auth.init_session_state()
+if st.session_state['user'] is None:
+    st.info("🔐 Log in on the main page to see your usage.")
+    st.stop()
+
+# Everything here reads the pre-aggregated tables, never the saved prompts themselves.
+analytics = get_analytics()
+user = st.session_state['user']
+st.markdown("## 📊 Usage Dashboard")
+
+col1, col2 = st.columns(2)
+if auth.is_admin(user):
+    scope = col1.selectbox("User", [ALL_USERS] + analytics.users(),
+                           format_func=lambda u: "All users" if u == ALL_USERS else u)
+else:
+    scope = user
+period = col2.select_slider("Period (days)", [7, 30, 90, 365, 3650], value=30)
+
+daily = analytics.daily(scope, since=date.today() - timedelta(days=period))
+if daily.empty or not daily["prompts"].sum():
+    st.caption("No saved prompts in this period yet.")
+    st.stop()
+
+total = int(daily["prompts"].sum())
+avg_chars = (daily["avg_prompt_chars"].fillna(0) * daily["prompts"]).sum() / total
+col1, col2, col3 = st.columns(3)
+col1.metric("Saved prompts", f"{total:,}")
+col2.metric("Avg prompt length", f"{avg_chars:,.0f} chars")
+# Weighted by generations, like per_user(): a day with one generation counts as one generation.
+generations = int(daily["generations"].sum())
+col3.metric("Avg generation time",
+            f"{daily['generation_ms'].sum() / generations / 1000:.1f} s" if generations else "—")
+
+st.markdown("### 📅 Prompts per day")
+st.bar_chart(daily.set_index("day")["prompts"])
+if generations:
+    st.markdown("### ⏱️ Generation latency (ms)")
+    st.line_chart(daily.set_index("day")[["avg_generation_ms", "avg_first_token_ms"]])
+
+col1, col2, col3 = st.columns(3)
+for column, dimension, title in ((col1, "tone", "🎭 Tone"), (col2, "output_type", "🧾 Format"), (col3, "template", "📁 Templates")):
+    with column:
+        st.markdown(f"### {title} · all time")
+        mix = analytics.mix(dimension, scope)
+        if mix.empty:
+            st.caption("Nothing recorded yet.")
+        else:
+            st.bar_chart(mix.set_index("value")["prompts"])
+
+if auth.is_admin(user) and scope == ALL_USERS:
+    st.markdown("### 👥 Per user")
+    st.dataframe(analytics.per_user(), hide_index=True, use_container_width=True)
@@ -0,0 +1,150 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+# PERF_METRICS=1 records a timing for every span. Finished requests are appended to
+# PERF_LOG as JSON lines, and PERF_PROM_PATH is refreshed at most every PROM_INTERVAL seconds
+# in Prometheus text format. When disabled, span() hands back one shared no-op context
+# manager and timed() returns the function unchanged.
+ENABLED = os.getenv("PERF_METRICS", "").lower() in ("1", "true", "yes")
+PERF_LOG = Path(os.getenv("PERF_LOG", Path(".cache") / "perf.jsonl"))
+PERF_PROM_PATH = Path(os.getenv("PERF_PROM_PATH", Path(".cache") / "metrics.prom"))
+PROM_INTERVAL = 10.0
+WINDOW = 1000
+QUANTILES = (0.5, 0.95, 0.99)
+
+_NULL = nullcontext()
+_request = contextvars.ContextVar("perf_request", default=None)
+_windows = {}
+_totals = {}
+_pending = []
+_lock = threading.Lock()
+_prom_written = 0.0
+
+
+def _record(name, seconds):
+    request = _request.get()
+    with _lock:
+        window = _windows.get(name)
+        if window is None:
+            window = _windows[name] = deque(maxlen=WINDOW)
+            _totals[name] = [0, 0.0]
+        window.append(seconds)
+        _totals[name][0] += 1
+        _totals[name][1] += seconds
+        _pending.append({
+            "ts": round(time.time(), 3),
+            "request": request and request["id"],
+            "label": request and request["label"],
+            "span": name,
+            "ms": round(seconds * 1000, 3),
+        })
+
+
+@contextmanager
+def _span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start)
+
+
+def record(name, seconds):
+    if ENABLED:
+        _record(name, seconds)
+
+
+def span(name):
+    return _span(name) if ENABLED else _NULL
+
+
+def timed(name):
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def begin_request(label="rerun"):
+    # Tags spans recorded on this thread (a Streamlit script run) until end_request().
+    if ENABLED:
+        _request.set({"id": uuid.uuid4().hex[:12], "label": label, "started": time.perf_counter()})
+
+
+def end_request():
+    request = _request.get()
+    if not ENABLED or request is None:
+        return
+    _record("request", time.perf_counter() - request["started"])
+    _request.set(None)
+    flush()
+
+
+def flush():
+    global _prom_written
+    with _lock:
+        lines, _pending[:] = list(_pending), []
+        write_prom = time.monotonic() - _prom_written >= PROM_INTERVAL
+        if write_prom:
+            _prom_written = time.monotonic()
+    try:
+        if lines:
+            PERF_LOG.parent.mkdir(parents=True, exist_ok=True)
+            with open(PERF_LOG, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(line) + "\n" for line in lines))
+        if write_prom:
+            write_prometheus(PERF_PROM_PATH)
+    except OSError:
+        pass  # metrics must never break a request
+
+
+def _quantile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _snapshot():
+    with _lock:
+        windows = {name: sorted(window) for name, window in _windows.items()}
+        totals = {name: list(total) for name, total in _totals.items()}
+    return windows, totals
+
+
+def summary():
+    # {span: {"count", "p50", "p95", "p99"}} over the recent window, in milliseconds.
+    windows, totals = _snapshot()
+    return {
+        name: {"count": totals[name][0], **{f"p{round(q * 100)}": _quantile(ordered, q) * 1000 for q in QUANTILES}}
+        for name, ordered in sorted(windows.items())
+    }
+
+
+def write_prometheus(path):
+    windows, totals = _snapshot()
+    lines = [
+        "# HELP prompt_synth_span_seconds Duration of instrumented phases (quantiles over the recent window).",
+        "# TYPE prompt_synth_span_seconds summary",
+    ]
+    for name, ordered in sorted(windows.items()):
+        for q in QUANTILES:
+            lines.append(f'prompt_synth_span_seconds{{span="{name}",quantile="{q}"}} {_quantile(ordered, q):.6f}')
+        lines.append(f'prompt_synth_span_seconds_sum{{span="{name}"}} {totals[name][1]:.6f}')
+        lines.append(f'prompt_synth_span_seconds_count{{span="{name}"}} {totals[name][0]}')
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    os.replace(tmp, path)
@@ -0,0 +1,61 @@
+import builtins
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# STARTUP_PROFILE=1 times every first-time import and each named phase of a script run,
+# and prints a report to stderr. Import this module before anything heavy.
+ENABLED = os.getenv("STARTUP_PROFILE", "").lower() in ("1", "true", "yes")
+REPORT_TOP_IMPORTS = 15
+
+import_times = {}
+phase_times = {}
+_run_started = time.perf_counter()
+_original_import = builtins.__import__
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        import_times.setdefault(name, time.perf_counter() - start)
+
+
+if ENABLED:
+    builtins.__import__ = _timed_import
+
+
+def start_run():
+    global _run_started
+    phase_times.clear()
+    _run_started = time.perf_counter()
+
+
+@contextmanager
+def phase(name):
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_times[name] = phase_times.get(name, 0.0) + time.perf_counter() - start
+
+
+def report(label="run"):
+    # Import times are inclusive of nested imports and only appear on the run that paid for them.
+    if not ENABLED:
+        return None
+    total = time.perf_counter() - _run_started
+    lines = [f"[startup-profile] {label}: {total * 1000:.1f} ms since process/run start"]
+    lines += [f"  phase  {name:<24}{seconds * 1000:9.1f} ms" for name, seconds in phase_times.items()]
+    slowest = sorted(import_times.items(), key=lambda item: item[1], reverse=True)[:REPORT_TOP_IMPORTS]
+    lines += [f"  import {name:<24}{seconds * 1000:9.1f} ms" for name, seconds in slowest]
+    import_times.clear()
+    print("\n".join(lines), file=sys.stderr)
+    return lines
@@ -1,22 +1,24 @@
+from dotenv import load_dotenv
+
+# First of all: perf reads PERF_METRICS at import time.
+load_dotenv()
+
+from utils import perf, profiling
+
+profiling.start_run()
+perf.begin_request("legacy")
+
 import streamlit as st
-import google.generativeai as genai
 from datetime import datetime
-import pandas as pd
 import os
 import random
-import json
 import html
-from dotenv import load_dotenv
 from streamlit_lottie import st_lottie
 
-# --- Load environment variables ---
-load_dotenv()
-IS_DEV = os.getenv("APP_MODE") == "dev"
+from utils.resources import get_model, get_lottie
+from utils.response_cache import cached_generate
 
-# --- Load Lottie JSON from local file ---
-def load_lottiefile(filepath: str):
-    with open(filepath, "r", encoding="utf-8") as f:
-        return json.load(f)
+IS_DEV = os.getenv("APP_MODE") == "dev"
 
 # --- Page Config ---
 st.set_page_config(page_title="Prompt Synthesizer", page_icon="🧠", layout="centered")
@@ -28,8 +30,8 @@ if not GOOGLE_API_KEY:
     st.stop()
 
 # --- Configure Gemini ---
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel("models/gemini-1.5-flash")
+with profiling.phase("config"):
+    model = get_model(GOOGLE_API_KEY)
 
 # --- Prompt Tips ---
 tips = [
@@ -44,11 +46,8 @@ tips = [
 random_tip = random.choice(tips)
 
 # --- Prompt History ---
+# Dev-only; the viewer below reads it through CSVHistoryStore, which shares the process-wide snapshot.
 history_path = "prompt_history.csv"
-if IS_DEV and os.path.exists(history_path):
-    past_prompts = pd.read_csv(history_path)
-else:
-    past_prompts = pd.DataFrame()
 
 # --- Tones ---
 valid_tones = [
@@ -181,8 +180,8 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- Sidebar ---
-with st.sidebar:
-    lottie_json = load_lottiefile("idea.json")
+with st.sidebar, profiling.phase("assets"):
+    lottie_json = get_lottie("idea.json")
     st_lottie(lottie_json, width=200, height=200, key="idea")
     st.markdown("<h2>💡 Prompt Toolkit</h2>", unsafe_allow_html=True)
     st.markdown(f"📌 <i>Tip of the Day:</i> <small>{random_tip}</small>", unsafe_allow_html=True)
@@ -217,6 +216,7 @@ with st.form("prompt_form"):
     save_txt = st.checkbox("💾 Save this to a .txt file?")
     depth = st.slider("🧬 Prompt Inception Depth", 1, 5, 1, help="How many layers deep should we go?")
     god_mode = st.checkbox("🛐 Enable Prompt God Mode (advanced recursion)")
+    bypass_cache = st.checkbox("♻️ Regenerate (skip cached result)")
     submitted = st.form_submit_button("✨ Generate Prompt")
 
 # --- Prompt Generation ---
@@ -268,14 +268,31 @@ Respond only with the generated prompt and tip.
 """
 
         try:
-            response = model.generate_content(prompt_template)
-            result = response.text
-            escaped_result = html.escape(result)
-
             st.markdown("## 🌟 Your Generated Prompt")
-            st.markdown(f"""
-                <div style='background-color: #fdfdfd; border-left: 5px solid #a777e3; border-radius: 0.5rem; padding: 1rem; font-family: monospace; font-size: 0.9rem; line-height: 1.6; white-space: pre-wrap; box-shadow: 0 4px 12px rgba(0,0,0,0.05);'>{escaped_result}</div>
-            """, unsafe_allow_html=True)
+            output = st.empty()
+            streamed = []
+
+            def render_result(text, cursor=""):
+                output.markdown(f"""
+                    <div style='background-color: #fdfdfd; border-left: 5px solid #a777e3; border-radius: 0.5rem; padding: 1rem; font-family: monospace; font-size: 0.9rem; line-height: 1.6; white-space: pre-wrap; box-shadow: 0 4px 12px rgba(0,0,0,0.05);'>{html.escape(text)}{cursor}</div>
+                """, unsafe_allow_html=True)
+
+            def render_chunk(text):
+                streamed.append(text)
+                render_result("".join(streamed), cursor=" ▌")
+
+            timings = {}
+            result, from_cache = cached_generate(
+                model, prompt_template, bypass=bypass_cache,
+                on_chunk=render_chunk, timings=timings,
+                goal=goal, tone=tone, output_type=output_type,
+                audience=audience, depth=depth, god_mode=god_mode
+            )
+            render_result(result)
+            if from_cache:
+                st.caption("⚡ Served from cache")
+            elif result:
+                st.caption(f"⏱️ First token {timings['first_token_ms']:.0f} ms · total {timings['total_ms']:.0f} ms")
 
             st.download_button("📥 Download Prompt", result, file_name="prompt.txt", mime="text/plain")
 
@@ -295,25 +312,19 @@ Respond only with the generated prompt and tip.
             }
 
             if IS_DEV:
-                if os.path.exists(history_path):
-                    df = pd.read_csv(history_path)
-                    df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-                else:
-                    df = pd.DataFrame([new_row])
-                df.to_csv(history_path, index=False)
+                from utils.history import append_row
+                append_row(history_path, new_row)
 
         except Exception as e:
             st.error(f"⚠️ Something went wrong:\n\n{e}")
 
 # --- History (dev only) ---
 if IS_DEV and os.path.exists(history_path):
+    from utils.history_store import CSVHistoryStore
+    from utils.ui import render_history
     st.markdown("## 🕰️ Prompt History")
     with st.expander("Click to view your saved prompts"):
-        history_df = pd.read_csv(history_path)
-        st.dataframe(history_df.style.set_properties(**{
-            'text-align': 'left',
-            'white-space': 'pre-wrap'
-        }), use_container_width=True)
+        render_history(CSVHistoryStore(".", filename=history_path), "demo")
 
 # --- Footer ---
 sign_offs = [
@@ -336,3 +347,6 @@ with st.expander("👋 About this app"):
         {random.choice(sign_offs)}
     </div>
     """, unsafe_allow_html=True)
+
+profiling.report()
+perf.end_request()
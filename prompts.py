@@ -1,84 +1,130 @@
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from types import MappingProxyType
 
 from utils.constants import category_emojis
 
-templates_by_category = {
-    "Work": {
-        "Email Draft": {
-            "goal": "Write a professional email about [topic]",
-            "tone": "Professional",
-            "output_type": "Text",
-            "audience": "Colleagues or business partners"
-        },
-        "Meeting Summary": {
-            "goal": "Summarize the key points from a meeting about [topic]",
-            "tone": "Clear and helpful",
-            "output_type": "Bullet List",
-            "audience": "Team members"
-        }
-    },
-    "Creative": {
-        "Story Idea": {
-            "goal": "Generate a creative story idea about [theme]",
-            "tone": "Creative",
-            "output_type": "Text",
-            "audience": "Writers"
-        },
-        "Blog Post": {
-            "goal": "Write a blog post about [topic]",
-            "tone": "Professional",
-            "output_type": "Markdown",
-            "audience": "General readers"
-        }
-    },
-    "Technical": {
-        "Code Explanation": {
-            "goal": "Explain how [code/algorithm] works",
-            "tone": "Clear and helpful",
-            "output_type": "Text",
-            "audience": "Developers"
-        },
-        "Documentation": {
-            "goal": "Create documentation for [project/feature]",
-            "tone": "Professional",
-            "output_type": "Markdown",
-            "audience": "Technical users"
-        }
-    },
-    "Personal": {
-        "Journal Prompt": {
-            "goal": "Create a reflective journal prompt about [topic]",
-            "tone": "Reflective",
-            "output_type": "Text",
-            "audience": "Personal use"
-        },
-        "Congratulations Message": {
-            "goal": "Write a congratulatory message for [occasion]",
-            "tone": "Motivational",
-            "output_type": "Text",
-            "audience": "Friends or family"
-        }
-    },
-    "Social Media": {
-        "Tweet Thread": {
-            "goal": "Create a thread of tweets about [topic]",
-            "tone": "Casual",
-            "output_type": "Conversation",
-            "audience": "Twitter followers"
-        },
-        "LinkedIn Post": {
-            "goal": "Write a professional LinkedIn post about [topic]",
-            "tone": "Professional",
-            "output_type": "Text",
-            "audience": "Professional network"
-        }
-    }
-}
+# Templates live in JSON (or YAML, if PyYAML is installed) files shaped like
+# {"category": "Work", "templates": {"Email Draft": {"goal": ..., "tone": ..., ...}}}.
+# TEMPLATE_DIRS adds extra directories (os.pathsep-separated) for team-shared templates.
+TEMPLATE_DIR = Path(__file__).parent / "templates"
+TEMPLATE_SUFFIXES = (".json", ".yaml", ".yml")
+RELOAD_CHECK_SECONDS = 2.0
+
+_token_re = re.compile(r"\w+")
+
+
+def _tokens(*fields):
+    return {token for field in fields for token in _token_re.findall(str(field or "").casefold())}
+
+
+def _load_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.suffix == ".json":
+            data = json.load(f)
+        else:
+            import yaml
+            data = yaml.safe_load(f)
+    category = data.get("category") or path.stem.replace("_", " ").title()
+    entries = {}
+    for name, template in (data.get("templates") or {}).items():
+        template = MappingProxyType(dict(template))
+        prefixes = {token[:i] for token in _tokens(name, template.get("goal"), template.get("audience"), category)
+                    for i in range(1, len(token) + 1)}
+        entries[name] = (template, prefixes)
+    return category, entries
+
+
+class TemplateRegistry:
+    # Immutable snapshot of every template plus a prefix -> names inverted index.
+    def __init__(self, files):
+        templates = {}
+        categories = {}
+        index = {}
+        for category, entries in files:
+            for name, (template, prefixes) in entries.items():
+                templates[name] = template
+                categories[name] = category
+                for prefix in prefixes:
+                    index.setdefault(prefix, set()).add(name)
+        order = list(category_emojis)
+        by_category = {}
+        for name in sorted(templates, key=str.casefold):
+            by_category.setdefault(categories[name], []).append(name)
+        self.templates = MappingProxyType(templates)
+        self.template_categories = MappingProxyType(categories)
+        self.names = tuple(templates)
+        self.categories = tuple(sorted(by_category, key=lambda c: (order.index(c) if c in order else len(order), c)))
+        self.by_category = MappingProxyType({c: tuple(names) for c, names in by_category.items()})
+        self._index = MappingProxyType({prefix: frozenset(names) for prefix, names in index.items()})
+
+    def search(self, query, limit=20):
+        # Every query word is matched as a prefix; names matching in the title rank first.
+        words = _tokens(query)
+        if not words:
+            return []
+        matches = None
+        for word in words:
+            postings = self._index.get(word, frozenset())
+            matches = postings if matches is None else matches & postings
+            if not matches:
+                return []
+        return sorted(matches, key=lambda name: (
+            -sum(any(t.startswith(w) for t in _tokens(name)) for w in words), name.casefold()
+        ))[:limit]
+
+
+class _RegistryLoader:
+    # Re-parses only files whose mtime/size changed, then rebuilds the snapshot.
+    def __init__(self):
+        self._files = {}
+        self._registry = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _paths(self):
+        dirs = [TEMPLATE_DIR] + [Path(d) for d in os.getenv("TEMPLATE_DIRS", "").split(os.pathsep) if d]
+        return sorted(p for d in dirs if d.is_dir() for p in d.iterdir() if p.suffix in TEMPLATE_SUFFIXES)
+
+    def get(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._registry is not None and now - self._checked < RELOAD_CHECK_SECONDS:
+                return self._registry
+            self._checked = now
+            changed = False
+            seen = set()
+            for path in self._paths():
+                stat = path.stat()
+                signature = (stat.st_mtime_ns, stat.st_size)
+                seen.add(path)
+                cached = self._files.get(path)
+                if cached and cached[0] == signature:
+                    continue
+                try:
+                    self._files[path] = (signature, _load_file(path))
+                    changed = True
+                except Exception:
+                    pass  # a half-saved or invalid file keeps its last good version
+            for path in set(self._files) - seen:
+                del self._files[path]
+                changed = True
+            if changed or self._registry is None:
+                self._registry = TemplateRegistry(loaded for _, loaded in self._files.values())
+            return self._registry
+
+
+_loader = _RegistryLoader()
+
+
+def get_registry():
+    return _loader.get()
+
 
 def get_flat_templates():
-    templates = {}
-    template_categories = {}
-    for category, entries in templates_by_category.items():
-        for name, data in entries.items():
-            templates[name] = data
-            template_categories[name] = category
-    return templates, template_categories
+    registry = get_registry()
+    return registry.templates, registry.template_categories
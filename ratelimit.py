@@ -0,0 +1,165 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+RATE_PER_SECOND = float(os.getenv("MODEL_RATE_LIMIT", 2.0))
+BURST = int(os.getenv("MODEL_RATE_BURST", 5))
+MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", 8))
+MAX_QUEUE = int(os.getenv("MODEL_MAX_QUEUE", 50))
+MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", 4))
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 20.0
+
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                   "DeadlineExceeded", "BadGateway", "GatewayTimeout"}
+THROTTLE_NAMES = {"ResourceExhausted", "TooManyRequests"}
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+def _code(error):
+    code = getattr(error, "code", None)
+    code = code() if callable(code) else code
+    return getattr(code, "value", code)
+
+
+def is_throttle(error):
+    return type(error).__name__ in THROTTLE_NAMES or _code(error) == 429
+
+
+def is_retryable(error):
+    return type(error).__name__ in RETRYABLE_NAMES or _code(error) in RETRYABLE_CODES
+
+
+def backoff_delay(attempt):
+    # "Full jitter": uniform over [0, min(cap, base * 2^attempt)].
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class AdaptiveLimiter:
+    # Token bucket for request rate plus an AIMD concurrency limit: +1/limit per success,
+    # halved on every throttling error. Waiters are served FIFO from a bounded queue.
+    def __init__(self, rate=RATE_PER_SECOND, burst=BURST, max_concurrency=MAX_CONCURRENCY, max_queue=MAX_QUEUE):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.tokens = float(burst)
+        self.stats = {"granted": 0, "throttled": 0, "retries": 0, "rejected": 0}
+        self._updated = time.monotonic()
+        self._queue = deque()
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def waiting(self):
+        return len(self._queue)
+
+    def acquire(self, on_wait=None):
+        # on_wait(position) is called whenever the caller's place in line changes, and with 0 once granted.
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise QueueFullError(f"The model is busy: {len(self._queue)} requests are already waiting. Try again shortly.")
+            ticket = object()
+            self._queue.append(ticket)
+            reported = None
+            try:
+                while True:
+                    position = self._queue.index(ticket) + 1
+                    timeout = None
+                    if position == 1 and self.in_flight < max(1, int(self.limit)):
+                        self._refill()
+                        if self.tokens >= 1:
+                            self.tokens -= 1
+                            self.in_flight += 1
+                            self._queue.popleft()
+                            self.stats["granted"] += 1
+                            self._cond.notify_all()
+                            break
+                        timeout = (1 - self.tokens) / self.rate
+                    if on_wait and position != reported:
+                        reported = position
+                        on_wait(position)
+                    self._cond.wait(timeout)
+            except BaseException:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                    self._cond.notify_all()
+                raise
+        if on_wait and reported:
+            on_wait(0)
+
+    def release(self, throttled=False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.stats["throttled"] += 1
+                self.limit = max(1.0, self.limit / 2)
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+def get_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = AdaptiveLimiter()
+        return _limiter
+
+
+class ThrottledModel:
+    # Every generate_content call waits for the shared limiter and retries retryable
+    # errors with jittered exponential backoff. Streams are retried up to their first chunk.
+    # Only this wrapper takes on_wait; the backends it wraps keep the plain genai signature.
+    reports_queue = True
+
+    def __init__(self, model, limiter=None, max_retries=MAX_RETRIES):
+        self.model = model
+        self.model_name = getattr(model, "model_name", "")
+        self.limiter = limiter or get_limiter()
+        self.max_retries = max_retries
+
+    def generate_content(self, prompt, stream=False, on_wait=None, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(on_wait)
+            try:
+                if not stream:
+                    result = self.model.generate_content(prompt, **kwargs)
+                else:
+                    chunks = iter(self.model.generate_content(prompt, stream=True, **kwargs))
+                    first = next(chunks, None)
+            except Exception as e:
+                self.limiter.release(throttled=is_throttle(e))
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+                self.limiter.stats["retries"] += 1
+                time.sleep(backoff_delay(attempt))
+                continue
+            if not stream:
+                self.limiter.release()
+                return result
+            return self._stream(first, chunks)
+
+    def _stream(self, first, chunks):
+        # Holds the concurrency slot until the stream is drained or closed.
+        try:
+            if first is not None:
+                yield first
+            yield from chunks
+        finally:
+            self.limiter.release()
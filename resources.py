@@ -0,0 +1,32 @@
+import os
+from pathlib import Path
+
+import streamlit as st
+
+from utils.helpers import load_lottiefile
+from utils.models import create_model
+
+
+# Built once per process and shared by every session. Cache keys carry whatever should
+# invalidate the entry: the API key and backend list for the model, mtime/size for files.
+
+@st.cache_resource(show_spinner=False)
+def _cached_model(api_key, backends):
+    return create_model(backends, api_key=api_key)
+
+
+def get_model(api_key):
+    return _cached_model(api_key, os.getenv("MODEL_BACKENDS"))
+
+
+@st.cache_resource(show_spinner=False)
+def _cached_lottie(path, mtime_ns, size):
+    return load_lottiefile(path)
+
+
+def get_lottie(path):
+    try:
+        stat = Path(path).stat()
+    except OSError:
+        return {}
+    return _cached_lottie(str(path), stat.st_mtime_ns, stat.st_size)
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from utils.generation import generate_text
+from utils.singleflight import SingleFlight
+
+CACHE_DB = Path(".cache") / "responses.db"
+MEMORY_ENTRIES = 256
+DISK_TTL_SECONDS = 7 * 24 * 3600
+DISK_MAX_BYTES = 64 * 1024 * 1024
+
+_cache = None
+_cache_lock = threading.Lock()
+flights = SingleFlight()
+
+
+def normalize_text(value):
+    return " ".join(str(value or "").split()).casefold()
+
+
+def make_cache_key(prompt_text, model_name="", **params):
+    # Normalized form inputs plus the rendered prompt, so template edits invalidate old entries.
+    payload = {
+        "model": model_name,
+        "params": {k: normalize_text(v) if isinstance(v, str) else v for k, v in sorted(params.items())},
+        "prompt": hashlib.sha256(normalize_text(prompt_text).encode("utf-8")).hexdigest(),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, db_path=CACHE_DB, max_entries=MEMORY_ENTRIES, ttl=DISK_TTL_SECONDS, max_bytes=DISK_MAX_BYTES):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0}
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key, text, created=None):
+        with self._lock:
+            self._memory[key] = (text, created or time.time())
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return entry[0]
+        with self._conn() as conn:
+            row = conn.execute("SELECT text, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] < self.ttl:
+                conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            else:
+                row = None
+        if row is None:
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            self.stats["disk_hits"] += 1
+        self._remember(key, row[0], row[1])
+        return row[0]
+
+    def set(self, key, text):
+        now = time.time()
+        self._remember(key, text)
+        size = len(text.encode("utf-8"))
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, text, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, text, size, now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until back under the budget.
+        excess = total - self.max_bytes
+        freed = 0
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            stale.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def hits(self):
+        return self.stats["memory_hits"] + self.stats["disk_hits"]
+
+
+def get_response_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                os.getenv("RESPONSE_CACHE_DB", CACHE_DB),
+                ttl=float(os.getenv("RESPONSE_CACHE_TTL", DISK_TTL_SECONDS)),
+            )
+        return _cache
+
+
+def cached_generate(model, prompt_text, bypass=False, on_chunk=None, timings=None, on_queue=None, **params):
+    # Returns (text, from_cache). Identical requests already in flight share that one call;
+    # empty responses are never cached. on_queue(position) reports rate-limiter queueing (0 = started).
+    cache = get_response_cache()
+    key = make_cache_key(prompt_text, getattr(model, "model_name", ""), **params)
+    if bypass:
+        cache.stats["bypassed"] += 1
+    else:
+        text = cache.get(key)
+        if text is not None:
+            return text, True
+
+    def produce(publish, set_status):
+        # Always streamed, so waiters that joined later can still render chunks as they arrive.
+        text = generate_text(model, prompt_text, on_chunk=publish, on_wait=set_status)
+        if text:
+            cache.set(key, text)
+        return text
+
+    text, _ = flights.run(key, produce, on_chunk=on_chunk, timings=timings, on_status=on_queue)
+    return text.strip(), False
@@ -0,0 +1,166 @@
+import argparse
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+
+from utils.history_store import add_save_listener
+
+# MinHash over character 3-grams with LSH banding: 16 bands x 4 rows puts pairs with
+# Jaccard >= ~0.6 in a shared bucket with high probability; candidates are then scored exactly.
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", 0.75))
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 31) - 1
+# Users whose index stays in memory; the least recently used one is dropped past this.
+GOAL_INDEX_USERS = int(os.getenv("GOAL_INDEX_USERS", 32))
+# What an index keeps per saved row besides its shingles; the row itself is fetched on reuse.
+KEY_FIELDS = ("timestamp", "tone", "output_type")
+
+_rng = np.random.default_rng(20250329)
+_a = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)[:, None]
+_b = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)[:, None]
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def normalize_goal(text):
+    return " ".join(re.sub(r"[^\w\s]", " ", str(text or "").casefold()).split())
+
+
+def shingles(text):
+    text = f" {normalize_goal(text)} "
+    if len(text) <= SHINGLE_SIZE:
+        return np.empty(0, dtype=np.uint64)
+    grams = {zlib.crc32(text[i:i + SHINGLE_SIZE].encode("utf-8")) for i in range(len(text) - SHINGLE_SIZE + 1)}
+    return np.fromiter(sorted(grams), dtype=np.uint64, count=len(grams))
+
+
+def minhash(shingle_ids):
+    return ((_a * shingle_ids[None, :] + _b) % _PRIME).min(axis=1)
+
+
+def jaccard(x, y):
+    common = np.intersect1d(x, y, assume_unique=True).size
+    return common / (x.size + y.size - common)
+
+
+class GoalIndex:
+    def __init__(self, threshold=SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self.keys = []
+        self._shingles = []
+        self._buckets = [{} for _ in range(BANDS)]
+        self._lock = threading.Lock()
+
+    def add(self, row):
+        shingle_ids = shingles(row.get("goal"))
+        if not shingle_ids.size:
+            return
+        signature = minhash(shingle_ids)
+        with self._lock:
+            position = len(self.keys)
+            self.keys.append(tuple(str(row.get(k) or "") for k in KEY_FIELDS))
+            self._shingles.append(shingle_ids)
+            for band, buckets in enumerate(self._buckets):
+                buckets.setdefault(signature[band * ROWS:(band + 1) * ROWS].tobytes(), []).append(position)
+
+    def find(self, goal, tone=None, output_type=None):
+        # Best (score, key) at or above the threshold, key being the row's KEY_FIELDS as a dict;
+        # ties go to matching settings, then the newest row. fetch_row turns the key into the row.
+        shingle_ids = shingles(goal)
+        if not shingle_ids.size:
+            return None
+        signature = minhash(shingle_ids)
+        with self._lock:
+            candidates = set()
+            for band, buckets in enumerate(self._buckets):
+                candidates.update(buckets.get(signature[band * ROWS:(band + 1) * ROWS].tobytes(), ()))
+            scored = [(jaccard(shingle_ids, self._shingles[i]), i) for i in candidates]
+        scored = [(score, i) for score, i in scored if score >= self.threshold]
+        if not scored:
+            return None
+        score, position = max(scored, key=lambda item: (
+            round(item[0], 3),
+            self.keys[item[1]][1:] == (tone, output_type),
+            item[1],
+        ))
+        return score, dict(zip(KEY_FIELDS, self.keys[position]))
+
+
+def fetch_row(store, user, key):
+    # The newest saved row matching a find() key, streamed from that day's rows only; None if it is gone.
+    try:
+        day = date.fromisoformat(key["timestamp"][:10])
+    except ValueError:
+        return None
+    filters = {"start": day, "end": day, "tone": [key["tone"]], "output_type": [key["output_type"]]}
+    found = None
+    for row in store.iter_rows(user, filters):
+        if str(row.get("timestamp") or "") == key["timestamp"]:
+            found = row
+    return found
+
+
+def get_goal_index(store, user):
+    # Built by streaming the user's saved history once on a background thread (lookups just miss
+    # until it is ready), then kept current by save events. Only the GOAL_INDEX_USERS most recently
+    # used indexes are kept; an evicted one is rebuilt on next use.
+    with _indexes_lock:
+        index = _indexes.get(user)
+        if index is None:
+            index = _indexes[user] = GoalIndex()
+
+            def build():
+                for row in store.iter_rows(user):
+                    index.add(row)
+
+            threading.Thread(target=build, name=f"goal-index-{user}", daemon=True).start()
+        _indexes.move_to_end(user)
+        while len(_indexes) > GOAL_INDEX_USERS:
+            _indexes.popitem(last=False)
+        return index
+
+
+def _on_saved(user, row):
+    with _indexes_lock:
+        index = _indexes.get(user)
+    if index is not None:
+        index.add(row)
+
+
+add_save_listener(_on_saved)
+
+
+def benchmark(sizes=(1_000, 10_000, 100_000), lookups=200, seed=7):
+    rng = random.Random(seed)
+    words = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(3, 9))) for _ in range(5000)]
+    for size in sizes:
+        index = GoalIndex()
+        goals = [" ".join(rng.choices(words, k=rng.randint(6, 14))) for _ in range(size)]
+        started = time.perf_counter()
+        for goal in goals:
+            index.add({"goal": goal})
+        build = time.perf_counter() - started
+        queries = [goals[rng.randrange(size)].upper() + "!" for _ in range(lookups)]
+        started = time.perf_counter()
+        hits = sum(index.find(query) is not None for query in queries)
+        lookup = (time.perf_counter() - started) / lookups
+        print(f"{size:>8} goals  build {build:6.2f} s  lookup {lookup * 1000:7.3f} ms  hits {hits}/{lookups}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark near-duplicate goal lookups against history size.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+    benchmark(args.sizes, args.lookups)
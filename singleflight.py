@@ -0,0 +1,122 @@
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+FLIGHT_WORKERS = 32
+
+# Flights run on their own pool rather than on the caller's thread, so a Streamlit session
+# that is interrupted mid-wait only drops out as a waiter instead of failing everyone else.
+_executor = ThreadPoolExecutor(max_workers=FLIGHT_WORKERS, thread_name_prefix="flight")
+
+
+class Flight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.done = False
+        self.result = None
+        self.error = None
+        self.status = None
+        self.waiters = 0
+
+    def publish(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def set_status(self, status):
+        with self.cond:
+            self.status = status
+            self.cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self.cond:
+            self.result, self.error, self.done = result, error, True
+            self.cond.notify_all()
+
+    def wait(self, on_chunk=None, timings=None, timeout=None, on_status=None):
+        # Blocks until finished, replaying chunks and status changes on the caller's thread.
+        start = time.perf_counter()
+        deadline = None if timeout is None else start + timeout
+        seen = 0
+        status = None
+        while True:
+            with self.cond:
+                while len(self.chunks) == seen and not self.done and self.status == status:
+                    remaining = None if deadline is None else deadline - time.perf_counter()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError("timed out waiting for an in-flight generation")
+                    self.cond.wait(remaining)
+                new = self.chunks[seen:]
+                seen += len(new)
+                done = self.done
+                changed = self.status != status
+                status = self.status
+            if changed and on_status:
+                on_status(status)
+            if new and timings is not None:
+                timings.setdefault("first_token_ms", (time.perf_counter() - start) * 1000)
+            if on_chunk:
+                for chunk in new:
+                    on_chunk(chunk)
+            if done:
+                break
+        if timings is not None:
+            timings["total_ms"] = (time.perf_counter() - start) * 1000
+            timings.setdefault("first_token_ms", timings["total_ms"])
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    # Callers asking for the same key while a call is in flight share it: each waiter gets
+    # the streamed chunks and the final result or error. A flight whose waiters have all
+    # left before it starts is cancelled; one already running finishes (and still feeds the cache).
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = {"flights": 0, "coalesced": 0, "abandoned": 0, "cancelled": 0, "errors": 0}
+
+    def run(self, key, produce, on_chunk=None, timings=None, timeout=None, on_status=None):
+        # produce(publish, set_status) does the real work; returns (result, shared).
+        # Chunks and status changes are delivered on each waiter's own thread.
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+                self.stats["flights"] += 1
+            else:
+                self.stats["coalesced"] += 1
+            with flight.cond:
+                flight.waiters += 1
+        if leader:
+            _executor.submit(self._fly, key, flight, produce)
+        try:
+            return flight.wait(on_chunk, timings, timeout, on_status), not leader
+        except BaseException as e:
+            if e is not flight.error:
+                with self._lock:
+                    self.stats["abandoned"] += 1
+            raise
+        finally:
+            with flight.cond:
+                flight.waiters -= 1
+
+    def _fly(self, key, flight, produce):
+        try:
+            if flight.waiters == 0:
+                with self._lock:
+                    self.stats["cancelled"] += 1
+                flight.finish(error=CancelledError())
+            else:
+                flight.finish(result=produce(flight.publish, flight.set_status))
+        except Exception as e:
+            with self._lock:
+                self.stats["errors"] += 1
+            flight.finish(error=e)
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
@@ -0,0 +1,48 @@
+from utils import history
+from utils.history import append_row, append_rows, encode_rows, iter_records, load_snapshot
+from utils.history_store import CSVHistoryStore
+
+
+def make_row(i, prompt="Line one\nline two\n\nline four"):
+    return {"timestamp": f"2026-01-01 10:00:{i:02d}", "goal": f"goal {i}", "tone": "Formal",
+            "output_type": "Email", "audience": "", "prompt": prompt}
+
+
+def restart():
+    # What a new process knows about the files: nothing.
+    history._record_ends.clear()
+    history._snapshots.clear()
+
+
+def tear_after_quoted_newline(path, row):
+    # A crash mid-append: the record stops right after a newline inside its quoted prompt.
+    data = encode_rows([row])
+    with open(path, "ab") as f:
+        f.write(data[:data.index(b"\n") + 1])
+
+
+def test_torn_multiline_record_is_dropped_on_next_append(tmp_path):
+    store = CSVHistoryStore(tmp_path)
+    path = store.path_for("demo")
+    append_rows(path, [make_row(i) for i in range(3)])
+    tear_after_quoted_newline(path, make_row(3))
+    assert path.read_bytes().endswith(b"\n")
+    restart()
+
+    append_row(path, make_row(4))
+    restart()
+
+    frame = load_snapshot(path)
+    assert frame["goal"].tolist() == ["goal 0", "goal 1", "goal 2", "goal 4"]
+    assert frame["prompt"].tolist()[-1] == make_row(4)["prompt"]
+    assert store.count("demo") == 4
+    assert [row["goal"] for row in iter_records(path)] == ["goal 0", "goal 1", "goal 2", "goal 4"]
+
+
+def test_torn_multiline_record_does_not_blank_the_snapshot(tmp_path):
+    path = tmp_path / "demo_prompt_history.csv"
+    append_rows(path, [make_row(i) for i in range(3)])
+    tear_after_quoted_newline(path, make_row(3))
+    restart()
+
+    assert load_snapshot(path)["goal"].tolist() == ["goal 0", "goal 1", "goal 2"]
@@ -0,0 +1,179 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import wave
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from utils import perf
+from utils.response_cache import get_response_cache, make_cache_key
+
+TRANSCRIBE_PROMPT = "Transcribe this voice message into a clear goal for an AI prompt."
+AUDIO_DIR = Path(".cache") / "audio"
+UPLOAD_CHUNK = 1024 * 1024
+RESAMPLE_FRAMES = 64 * 1024
+# Above this size audio goes through the Gemini File API (resumable, chunked upload) instead of inline.
+INLINE_MAX_BYTES = int(os.getenv("TRANSCRIBE_INLINE_MAX_BYTES", 4 * 1024 * 1024))
+# Audio is downmixed to mono at this rate before upload; 0 sends it as uploaded.
+TRANSCRIBE_SAMPLE_RATE = int(os.getenv("TRANSCRIBE_SAMPLE_RATE", 16000))
+AUDIO_MIME_TYPES = {".wav": "audio/wav", ".mp3": "audio/mp3", ".ogg": "audio/ogg"}
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="transcribe")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def spool_upload(upload):
+    # Copies an upload to disk in chunks, hashing as it goes; returns (sha256 hex, path).
+    AUDIO_DIR.mkdir(parents=True, exist_ok=True)
+    suffix = Path(upload.name).suffix.lower()
+    digest = hashlib.sha256()
+    upload.seek(0)
+    with tempfile.NamedTemporaryFile(dir=AUDIO_DIR, suffix=suffix, delete=False) as f:
+        for chunk in iter(lambda: upload.read(UPLOAD_CHUNK), b""):
+            digest.update(chunk)
+            f.write(chunk)
+    path = AUDIO_DIR / f"{digest.hexdigest()}{suffix}"
+    os.replace(f.name, path)
+    return digest.hexdigest(), path
+
+
+def _resample_wav(src, dst, rate):
+    # Streams 16-bit PCM through a mono downmix and linear-interpolation resampler.
+    with wave.open(str(src), "rb") as reader, wave.open(str(dst), "wb") as writer:
+        channels, width, src_rate = reader.getnchannels(), reader.getsampwidth(), reader.getframerate()
+        if width != 2 or (channels == 1 and src_rate <= rate):
+            return False
+        out_rate = min(rate, src_rate)
+        step = src_rate / out_rate
+        writer.setnchannels(1)
+        writer.setsampwidth(2)
+        writer.setframerate(out_rate)
+        start = 0
+        written = 0
+        previous = None
+        while True:
+            frames = reader.readframes(RESAMPLE_FRAMES)
+            if not frames:
+                break
+            mono = np.frombuffer(frames, dtype="<i2").reshape(-1, channels).mean(axis=1)
+            # Carry the previous chunk's last sample so interpolation spans chunk boundaries.
+            samples = mono if previous is None else np.concatenate(([previous], mono))
+            first = start if previous is None else start - 1
+            end = start + len(mono) - 1
+            positions = np.arange(written, int(end / step) + 1) * step
+            if positions.size:
+                resampled = np.interp(positions, np.arange(first, first + len(samples)), samples)
+                writer.writeframes(np.round(resampled).astype("<i2").tobytes())
+                written += positions.size
+            previous = mono[-1]
+            start += len(mono)
+    return True
+
+
+def compact_audio(path):
+    # Returns (path, mime type) of the smallest version we can make locally: mono Opus at
+    # TRANSCRIBE_SAMPLE_RATE via ffmpeg if it is installed, else a resampled WAV, else the original.
+    path = Path(path)
+    if TRANSCRIBE_SAMPLE_RATE:
+        if shutil.which("ffmpeg"):
+            target = path.with_suffix(".small.ogg")
+            result = subprocess.run(
+                ["ffmpeg", "-y", "-loglevel", "error", "-i", str(path), "-ac", "1",
+                 "-ar", str(TRANSCRIBE_SAMPLE_RATE), "-c:a", "libopus", "-b:a", "24k", str(target)],
+                capture_output=True,
+            )
+            if result.returncode == 0:
+                return target, AUDIO_MIME_TYPES[".ogg"]
+        elif path.suffix == ".wav":
+            target = path.with_suffix(".small.wav")
+            try:
+                if _resample_wav(path, target, TRANSCRIBE_SAMPLE_RATE):
+                    return target, AUDIO_MIME_TYPES[".wav"]
+            except (wave.Error, EOFError, ValueError):
+                pass  # not plain PCM; send it as uploaded
+            target.unlink(missing_ok=True)
+    return path, AUDIO_MIME_TYPES.get(path.suffix, "application/octet-stream")
+
+
+def audio_part(path, mime_type):
+    if path.stat().st_size > INLINE_MAX_BYTES:
+        try:
+            import google.generativeai as genai
+            return genai.upload_file(path, mime_type=mime_type)
+        except Exception:
+            pass  # no Gemini client or key (e.g. fake backends); fall back to inline data
+    return {"mime_type": mime_type, "data": path.read_bytes()}
+
+
+@perf.timed("transcribe")
+def _transcribe(model, key, path):
+    # The spool only lives as long as its transcription: a retry spools the upload again.
+    try:
+        small, mime_type = compact_audio(path)
+        try:
+            response = model.generate_content([TRANSCRIBE_PROMPT, audio_part(small, mime_type)])
+        finally:
+            if small != path:
+                small.unlink(missing_ok=True)
+    finally:
+        path.unlink(missing_ok=True)
+    text = getattr(response, "text", "").strip()
+    if text:
+        get_response_cache().set(key, text)
+    return text
+
+
+def _key(model, digest):
+    return make_cache_key(digest, getattr(model, "model_name", ""), task="transcribe")
+
+
+def transcribe_async(model, digest, path):
+    # Future for the transcript of the audio with this content hash. Cached transcripts come back
+    # already resolved; identical audio already being transcribed shares the running job.
+    key = _key(model, digest)
+    text = get_response_cache().get(key)
+    if text is not None:
+        Path(path).unlink(missing_ok=True)
+        future = Future()
+        future.set_result(text)
+        return future
+    with _jobs_lock:
+        future = _jobs.get(key)
+        if future is not None:
+            return future
+        future = _jobs[key] = _executor.submit(_transcribe, model, key, Path(path))
+
+    def done(f):
+        # Transcripts are cached, so only failed and empty jobs stay around (until retried or
+        # discarded): the audio is not sent again on every rerun.
+        if f.exception() is None and f.result():
+            _forget(key)
+
+    future.add_done_callback(done)
+    return future
+
+
+def _forget(key):
+    with _jobs_lock:
+        _jobs.pop(key, None)
+
+
+def retry(model, digest):
+    _forget(_key(model, digest))
+
+
+def discard(model, digest, path):
+    # The upload is gone: forget its failed or empty result and delete its spool, if no
+    # transcription is still using it (that one deletes the spool itself).
+    with _jobs_lock:
+        future = _jobs.get(_key(model, digest))
+    if future is not None and not future.done():
+        return
+    retry(model, digest)
+    Path(path).unlink(missing_ok=True)
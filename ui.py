@@ -2,9 +2,20 @@
 import streamlit as st
 import random
 import re
-from streamlit_lottie import st_lottie
-from utils.constants import category_emojis, sign_offs, tips
-from utils.prompts import templates_by_category, get_flat_templates
+from utils import perf
+from utils.constants import category_emojis, output_types, sign_offs, tips, valid_tones
+from utils.prompts import get_registry
+
+TEMPLATE_PAGE_SIZE = 8
+TEMPLATE_SEARCH_LIMIT = 20
+HISTORY_PAGE_SIZE = 25
+HISTORY_PREVIEW_CHARS = 120
+HISTORY_SORTS = {
+    "Newest first": ("timestamp", True),
+    "Oldest first": ("timestamp", False),
+    "Tone": ("tone", False),
+    "Format": ("output_type", False),
+}
 
 def render_header():
     st.markdown("""
@@ -15,24 +26,109 @@ def render_header():
     """, unsafe_allow_html=True)
 
 def render_sidebar(lottie_json):
+    from streamlit_lottie import st_lottie
     st_lottie(lottie_json, width=200, height=200, key="idea")
     st.markdown("### 💡 Prompt Toolkit")
     st.markdown(f"📌 *Tip of the Day:* **{st.session_state.random_tip}**")
     st.markdown("---")
 
-    templates, _ = get_flat_templates()
+    registry = get_registry()
 
-    if st.button("🎲 Surprise Me!"):
-        st.session_state.selected_template = random.choice(list(templates.keys()))
+    if st.button("🎲 Surprise Me!") and registry.names:
+        st.session_state.selected_template = random.choice(registry.names)
 
     st.markdown("### 📁 Templates")
-    for category, entries in templates_by_category.items():
-        emoji = category_emojis.get(category, "")
-        st.markdown(f"**{emoji} {category}**")
-        for name in entries:
-            key_safe = re.sub(r'\W+', '_', name)
-            if st.button(name, key=f"btn_{key_safe}"):
-                st.session_state.selected_template = name
+    query = st.text_input("🔎 Search templates", key="template_query")
+    if query.strip():
+        names = registry.search(query, limit=TEMPLATE_SEARCH_LIMIT)
+        st.caption(f"{len(names)} match{'es' if len(names) != 1 else ''}")
+    elif registry.categories:
+        category = st.selectbox("Category", registry.categories, key="template_category",
+                                format_func=lambda c: f"{category_emojis.get(c, '')} {c}".strip())
+        names = registry.by_category[category]
+        page_count = -(-len(names) // TEMPLATE_PAGE_SIZE)
+        if page_count > 1:
+            page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1, key=f"template_page_{category}")
+            names = names[(page - 1) * TEMPLATE_PAGE_SIZE:page * TEMPLATE_PAGE_SIZE]
+    else:
+        names = ()
+
+    for name in names:
+        key_safe = re.sub(r'\W+', '_', name)
+        if st.button(name, key=f"btn_{key_safe}"):
+            st.session_state.selected_template = name
+
+def render_history(store, user, key="history"):
+    # Only the visible page is fetched, with prompts cut to a preview; the full prompt is
+    # loaded on demand for the selected row.
+    col1, col2 = st.columns(2)
+    tones = col1.multiselect("🎭 Tone", valid_tones, key=f"{key}_tones")
+    formats = col2.multiselect("🧾 Format", output_types, key=f"{key}_formats")
+    col1, col2 = st.columns(2)
+    sort = col1.selectbox("Sort by", list(HISTORY_SORTS), key=f"{key}_sort")
+    dates = col2.date_input("Dates", value=(), key=f"{key}_dates")
+    filters = {"tone": tones, "output_type": formats}
+    if len(dates) == 2:
+        filters["start"], filters["end"] = dates
+    elif len(dates) == 1:
+        filters["start"] = dates[0]
+
+    total = store.count(user, filters)
+    if not total:
+        st.caption("No saved prompts match these filters.")
+        return
+    page_count = -(-total // HISTORY_PAGE_SIZE)
+    if st.session_state.get(f"{key}_page", 1) > page_count:
+        st.session_state[f"{key}_page"] = page_count
+    page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1, key=f"{key}_page")
+    st.caption(f"{total} saved prompts · page {page} of {page_count}")
+    rows = store.page(user, (page - 1) * HISTORY_PAGE_SIZE, HISTORY_PAGE_SIZE,
+                      filters=filters, sort=HISTORY_SORTS[sort], preview_chars=HISTORY_PREVIEW_CHARS)
+    event = st.dataframe(rows.drop(columns="id"), use_container_width=True, hide_index=True,
+                         on_select="rerun", selection_mode="single-row", key=f"{key}_table")
+    selected = event.selection.rows if event else []
+    if selected and selected[0] < len(rows):
+        row = store.get(user, int(rows["id"].iloc[selected[0]]))
+        if row:
+            st.markdown(f"**{row['goal']}** · {row['tone']} · {row['output_type']} · {row['timestamp']}")
+            st.code(row["prompt"], language="markdown")
+
+def render_export(store, user, key="export"):
+    # Nothing is read until the button is clicked; the export is then streamed from the store.
+    from utils.constants import history_columns
+    from utils.export import EXPORT_FORMATS, export_filename, export_mime, spool_export
+    col1, col2, col3 = st.columns(3)
+    fmt = col1.selectbox("Export format", list(EXPORT_FORMATS), format_func=str.upper, key=f"{key}_format")
+    dates = col2.date_input("Export dates", value=(), key=f"{key}_dates")
+    compress = col3.checkbox("gzip", key=f"{key}_gzip")
+    fields = st.multiselect("Fields", history_columns, default=history_columns, key=f"{key}_fields")
+    filters = {}
+    if len(dates) == 2:
+        filters["start"], filters["end"] = dates
+    elif len(dates) == 1:
+        filters["start"] = dates[0]
+    st.download_button(
+        f"📂 Download History {fmt.upper()}{' (gzip)' if compress else ''}",
+        lambda: spool_export(store, user, fmt, fields, filters, compress),
+        file_name=export_filename(fmt, compress), mime=export_mime(fmt, compress),
+        disabled=not fields, key=f"{key}_download",
+    )
+
+def render_perf_panel():
+    with st.expander("⏱️ Performance"):
+        if not perf.ENABLED:
+            st.caption("Set PERF_METRICS=1 to record timings.")
+            return
+        stats = perf.summary()
+        if not stats:
+            st.caption("No timings recorded yet.")
+            return
+        st.dataframe(
+            [{"span": name, "count": s["count"], "p50 ms": round(s["p50"], 1),
+              "p95 ms": round(s["p95"], 1), "p99 ms": round(s["p99"], 1)} for name, s in stats.items()],
+            hide_index=True, use_container_width=True,
+        )
+        st.caption(f"Recent {perf.WINDOW} samples per span · log: {perf.PERF_LOG} · metrics: {perf.PERF_PROM_PATH}")
 
 def render_footer():
     st.markdown(f"<div style='text-align: center; font-size: 0.9rem; color: gray;'>{random.choice(sign_offs)}</div>", unsafe_allow_html=True)